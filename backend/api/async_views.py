@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from recipes.ingredient_index import get_ingredient_index
+
+from .cache import (
+    get_cache_key,
+    get_user_state,
+    overlay_counters,
+    record,
+)
+from .metrics import count_queries
+from .profiling import profile_thread, render_timer
+from .renderers import encode_json
+from .views import IngredientViewSet
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.ASGI_THREADS,
+    thread_name_prefix='asgi-views',
+)
+
+
+def in_thread(func):
+    """
+    Корутина, выполняющая func в пуле из ASGI_THREADS потоков.
+    Синхронный код под ASGI Django 3.2 выполняет в одном общем потоке
+    на процесс, поэтому блокирующая работа представлений идёт сюда.
+    У потока пула своё соединение с БД: оно закрывается или остаётся
+    открытым по CONN_MAX_AGE, как между запросами под WSGI.
+    """
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            with count_queries(), profile_thread():
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False, executor=_executor)
+
+
+def call_view(view, request, args, kwargs):
+    """Вызывает представление и готовит тело ответа в потоке пула."""
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        with render_timer():
+            response.render()
+    elif response.streaming:
+        # Потоковый ответ Django 3.2 читает в цикле событий, где
+        # запросы к БД запрещены.
+        response.streaming_content = list(response.streaming_content)
+    return response
+
+
+def authenticate(request):
+    """
+    Пользователь запроса, как его определит DRF. None — учётные данные
+    неверны, ответ с ошибкой вернёт само представление.
+    """
+    drf_request = Request(request, authenticators=[
+        authenticator()
+        for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    try:
+        return drf_request.user
+    except APIException:
+        return None
+
+
+def json_response(content):
+    response = HttpResponse(content, content_type='application/json')
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def get_cached(request, group):
+    """Данные ответа из кэша CachedResponseMixin или None."""
+    if authenticate(request) is None:
+        return None
+    data = cache.get(get_cache_key(group, request))
+    if data is not None:
+        record(group, 'hit')
+    return data
+
+
+def cached_response(data):
+    response = json_response(encode_json(data))
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def cached_tags(request, **kwargs):
+    data = get_cached(request, 'tags')
+    if data is None:
+        return None
+    return cached_response(data)
+
+
+def cached_recipe(request, **kwargs):
+    """Рецепт из общего кэша с признаками пользователя, как retrieve."""
+    data = get_cached(request, 'recipes')
+    if data is None:
+        return None
+    return cached_response(
+        get_user_state(request).overlay_recipe(overlay_counters(data))
+    )
+
+
+async def search_ingredients(request, **kwargs):
+    """
+    Автодополнение по индексу в памяти прямо в цикле событий. В пул
+    потоков уходят только проверка токена и построение индекса.
+    """
+    if not settings.INGREDIENT_INDEX_ENABLED:
+        return None
+    if (
+        'HTTP_AUTHORIZATION' in request.META
+        and await in_thread(authenticate)(request) is None
+    ):
+        return None
+    index = get_ingredient_index(build=False)
+    if index is None:
+        index = await in_thread(get_ingredient_index)()
+    return json_response(encode_json(index.search(
+        request.GET.get('name', ''), IngredientViewSet.get_limit(request.GET)
+    )))
+
+
+# Имя маршрута: корутина, которая возвращает готовый ответ или None.
+FAST_PATHS = {
+    'tags-list': in_thread(cached_tags),
+    'tags-detail': in_thread(cached_tags),
+    'recipes-detail': in_thread(cached_recipe),
+    'ingredients-list': search_ingredients,
+}
+
+
+def wants_json(request, kwargs):
+    """GET за JSON: без суффикса и параметра format, не из браузера."""
+    return (
+        request.method == 'GET'
+        and 'format' not in kwargs
+        and api_settings.URL_FORMAT_OVERRIDE not in request.GET
+        and 'text/html' not in request.META.get('HTTP_ACCEPT', '')
+    )
+
+
+def async_view(view, fast_path=None):
+    """
+    Асинхронная обёртка представления DRF. Запрос за JSON сначала
+    обрабатывает fast_path, остальные запросы и промахи выполняет view
+    в пуле потоков.
+    """
+    run_view = in_thread(call_view)
+
+    async def wrapper(request, *args, **kwargs):
+        if fast_path is not None and wants_json(request, kwargs):
+            response = await fast_path(request, **kwargs)
+            if response is not None:
+                return response
+        return await run_view(view, request, args, kwargs)
+
+    # Атрибуты представления DRF (cls, actions, initkwargs) нужны
+    # профилированию и схеме API; update_wrapper переносит их вместе
+    # с __dict__.
+    update_wrapper(wrapper, view)
+    wrapper.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return wrapper
+
+
+def async_urls(patterns):
+    """
+    Маршруты роутера для ASGI_MODE: все представления асинхронные,
+    теги, рецепт и автодополнение ингредиентов отдаются из кэша и
+    индекса по FAST_PATHS. Лента рецептов и подписки строятся запросами
+    к БД, а асинхронного ORM в Django 3.2 нет, поэтому они выполняются
+    в пуле потоков целиком.
+    """
+    return [
+        URLPattern(
+            pattern.pattern,
+            async_view(pattern.callback, FAST_PATHS.get(pattern.name)),
+            pattern.default_args,
+            pattern.name,
+        )
+        for pattern in patterns
+    ]
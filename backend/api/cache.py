@@ -0,0 +1,223 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, Value
+from rest_framework.response import Response
+
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag
+from users.models import Follow
+
+from .metrics import CACHE_REQUESTS
+from .renderers import JSONFragment, encode_json
+
+# Счётчики попаданий и промахов кэша текущего процесса: (группа, исход).
+stats = Counter()
+
+
+def record(group, result):
+    """Учитывает обращение к кэшу здесь и в метриках Prometheus."""
+    stats[group, result] += 1
+    CACHE_REQUESTS.labels(group, result).inc()
+
+
+def get_version(group):
+    """
+    Текущая версия группы закэшированных ответов.
+    Если ключ версии вытеснен из кэша, версия начинается с текущего
+    времени, чтобы не совпасть с прежними ключами.
+    """
+    key = f'catalogue:version:{group}'
+    version = cache.get(key)
+    if version is not None:
+        return version
+    version = int(time.time() * 1000)
+    cache.add(key, version, None)
+    return cache.get(key, version)
+
+
+def bump_version(*groups):
+    """Делает недействительными все закэшированные ответы групп."""
+    for group in groups:
+        try:
+            cache.incr(f'catalogue:version:{group}')
+        except ValueError:
+            get_version(group)
+
+
+def get_tag_ids():
+    """
+    Соответствие слагов тегов их id.
+    Хранится в кэше под версией группы tags и обновляется вместе с ней.
+    """
+    key = f'catalogue:tags:{get_version("tags")}:slug_ids'
+    tag_ids = cache.get(key)
+    record('tag_ids', 'miss' if tag_ids is None else 'hit')
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, settings.CATALOGUE_CACHE_TIMEOUT)
+    return tag_ids
+
+
+def get_cache_key(group, request):
+    """Ключ закэшированного ответа: группа, её версия и полный путь."""
+    return f'catalogue:{group}:{get_version(group)}:{request.get_full_path()}'
+
+
+class CachedResponseMixin:
+    """
+    Кэширование ответов действий только для чтения.
+    Ключ содержит группу, версию группы и полный путь запроса
+    с параметрами. Версия увеличивается сигналами при изменении
+    данных (см. api.signals), поэтому устаревшие ответы не отдаются.
+    """
+    cache_group = None
+    cache_actions = ('list', 'retrieve')
+    cache_anonymous_only = False
+
+    def encode_for_cache(self, data):
+        """
+        В кэше хранится готовый JSON: ответ из кэша отдаётся без
+        повторного кодирования.
+        """
+        return JSONFragment(encode_json(data))
+
+    def from_cache(self, data):
+        """Данные ответа, взятые из кэша, перед отдачей."""
+        return data
+
+    def get_cached_response(self, request, build_response):
+        if (
+            self.action not in self.cache_actions
+            or (self.cache_anonymous_only and request.user.is_authenticated)
+        ):
+            return build_response()
+        key = get_cache_key(self.cache_group, request)
+        data = cache.get(key)
+        if data is not None:
+            record(self.cache_group, 'hit')
+            response = Response(self.from_cache(data))
+            response['X-Cache'] = 'HIT'
+            return response
+        record(self.cache_group, 'miss')
+        response = build_response()
+        if response.status_code == 200:
+            cache.set(
+                key,
+                self.encode_for_cache(response.data),
+                settings.CATALOGUE_CACHE_TIMEOUT,
+            )
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+
+class UserState:
+    """
+    Избранное, список покупок и подписки пользователя как множества id.
+    Загружается один раз за запрос или берётся из общего кэша, поэтому
+    признаки is_favorited, is_in_shopping_cart и is_subscribed
+    проверяются без запросов к БД.
+    """
+
+    def __init__(self, favorites=(), cart=(), following=()):
+        self.favorites = frozenset(favorites)
+        self.cart = frozenset(cart)
+        self.following = frozenset(following)
+
+    @staticmethod
+    def get_key(user_id):
+        return f'user_state:{user_id}'
+
+    @classmethod
+    def load(cls, user_id):
+        key = cls.get_key(user_id)
+        state = cache.get(key)
+        record('user_state', 'miss' if state is None else 'hit')
+        if state is None:
+            ids = {'favorites': [], 'cart': [], 'following': []}
+            # Одним запросом: UNION ALL трёх таблиц с меткой источника.
+            rows = Favorite.objects.filter(user_id=user_id).values_list(
+                Value('favorites', output_field=CharField()), 'recipe_id'
+            ).union(
+                ShoppingCart.objects.filter(user_id=user_id).values_list(
+                    Value('cart', output_field=CharField()), 'recipe_id'
+                ),
+                Follow.objects.filter(user_id=user_id).values_list(
+                    Value('following', output_field=CharField()), 'author_id'
+                ),
+                all=True,
+            )
+            for kind, pk in rows:
+                ids[kind].append(pk)
+            state = cls(**ids)
+            cache.set(key, state, settings.USER_STATE_CACHE_TIMEOUT)
+        return state
+
+    @classmethod
+    def invalidate(cls, user_id):
+        """Вызывается после изменения избранного, покупок или подписок."""
+        cache.delete(cls.get_key(user_id))
+
+    @classmethod
+    def invalidate_many(cls, user_ids):
+        cache.delete_many([cls.get_key(user_id) for user_id in user_ids])
+
+    def overlay_recipe(self, data):
+        """Подставляет признаки пользователя в общий для всех рецепт."""
+        data['is_favorited'] = data['id'] in self.favorites
+        data['is_in_shopping_cart'] = data['id'] in self.cart
+        data['author']['is_subscribed'] = (
+            data['author']['id'] in self.following
+        )
+        return data
+
+
+UserState.EMPTY = UserState()
+
+
+def overlay_counters(data):
+    """
+    Подставляет в общий для всех рецепт текущие счётчики одним запросом.
+    Счётчики меняются через F() без сигналов (recipes.counters), поэтому
+    кэш рецептов при этом не сбрасывается.
+    """
+    counters = Recipe.objects.filter(pk=data['id']).values_list(
+        'favorites_count',
+        'shopping_count',
+        'author__recipes_count',
+        'author__followers_count',
+    ).first()
+    if counters is not None:
+        (
+            data['favorites_count'],
+            data['shopping_count'],
+            data['author']['recipes_count'],
+            data['author']['followers_count'],
+        ) = counters
+    return data
+
+
+def get_user_state(request):
+    """Состояние пользователя запроса, загружается один раз за запрос."""
+    if request.user.is_anonymous:
+        return UserState.EMPTY
+    state = getattr(request, '_user_state', None)
+    if state is None:
+        state = UserState.load(request.user.pk)
+        request._user_state = state
+    return state
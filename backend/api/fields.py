@@ -0,0 +1,152 @@
+import binascii
+import os
+import uuid
+import warnings
+from base64 import b64decode
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers
+
+# Формат Pillow: расширение файла.
+IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+# Начало файлов этих форматов; у WebP сигнатура WEBP идёт с 8-го байта.
+SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')
+SIGNATURE_SIZE = 12
+# Длина куска base64, кратна 4; декодируется около 192 КБ за раз.
+CHUNK_SIZE = 256 * 1024
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """
+    Картинка в base64 (data URI или голая строка).
+    Строка декодируется кусками во временный файл, который уходит на
+    диск после FILE_UPLOAD_MAX_MEMORY_SIZE байт, поэтому в памяти нет
+    полной копии картинки. Размер проверяется по длине строки ещё до
+    декодирования, а сигнатура и размеры в пикселях — по заголовку,
+    как только он декодирован, без распаковки изображения: не картинка
+    и слишком большая картинка отклоняются после первого куска.
+    """
+    default_error_messages = {
+        'invalid_image': 'Загрузите корректную картинку в base64.',
+        'invalid_format': 'Допустимые форматы: JPEG, PNG, GIF, WebP.',
+        'too_large': 'Картинка больше {max_bytes} байт.',
+        'too_many_pixels': 'Картинка больше {max_pixels} пикселей.',
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or not data:
+            self.fail('invalid_image')
+        start = data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        max_bytes = settings.IMAGE_UPLOAD_MAX_BYTES
+        if (len(data) - start) // 4 * 3 > max_bytes:
+            self.fail('too_large', max_bytes=max_bytes)
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        try:
+            self.decode(data, start, file)
+            extension = self.check_image(file)
+        except Exception:
+            file.close()
+            raise
+        file.seek(0)
+        return File(file, name=f'{uuid.uuid4()}.{extension}')
+
+    def decode(self, data, start, file):
+        """
+        Декодирует data[start:] в file кусками по CHUNK_SIZE символов.
+        Заголовок проверяется после каждого куска, пока не прочитан.
+        """
+        max_bytes = settings.IMAGE_UPLOAD_MAX_BYTES
+        rest = ''
+        size = 0
+        header_checked = False
+        for position in range(start, len(data), CHUNK_SIZE):
+            chunk = rest + ''.join(
+                data[position:position + CHUNK_SIZE].split()
+            )
+            end = len(chunk) // 4 * 4
+            rest = chunk[end:]
+            try:
+                decoded = b64decode(chunk[:end], validate=True)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
+            size += len(decoded)
+            if size > max_bytes:
+                self.fail('too_large', max_bytes=max_bytes)
+            file.write(decoded)
+            if not header_checked:
+                header_checked = self.check_header(file, size)
+        if rest or not size:
+            self.fail('invalid_image')
+
+    def check_header(self, file, size):
+        """
+        Проверяет сигнатуру и размеры по декодированному началу файла.
+        False — заголовок декодирован не целиком, проверка повторится
+        после следующего куска; окончательно файл проверяет check_image.
+        """
+        file.seek(0)
+        head = file.read(SIGNATURE_SIZE)
+        try:
+            if size < SIGNATURE_SIZE:
+                return False
+            if not (
+                head.startswith(SIGNATURES)
+                or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+            ):
+                self.fail('invalid_format')
+            try:
+                image = self.open_image(file)
+            except (UnidentifiedImageError, OSError):
+                return False
+            self.check_pixels(image)
+            return True
+        finally:
+            file.seek(0, os.SEEK_END)
+
+    def open_image(self, file):
+        """Image.open с проверкой предела пикселей вместо предупреждения."""
+        file.seek(0)
+        try:
+            with warnings.catch_warnings():
+                # Предел пикселей проверяет check_pixels.
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                return Image.open(file)
+        except Image.DecompressionBombError:
+            self.fail(
+                'too_many_pixels',
+                max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS,
+            )
+
+    def check_pixels(self, image):
+        max_pixels = settings.IMAGE_UPLOAD_MAX_PIXELS
+        if image.width * image.height > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+
+    def check_image(self, file):
+        """
+        Проверяет формат и размеры по заголовку, затем целостность файла.
+        Возвращает расширение файла.
+        """
+        try:
+            image = self.open_image(file)
+        except (UnidentifiedImageError, OSError):
+            self.fail('invalid_image')
+        if image.format not in IMAGE_FORMATS:
+            self.fail('invalid_format')
+        self.check_pixels(image)
+        try:
+            image.verify()
+        except Exception:
+            self.fail('invalid_image')
+        return IMAGE_FORMATS[image.format]
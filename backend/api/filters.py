@@ -1,12 +1,29 @@
-from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart
+from recipes.search import search_recipes
 from users.models import MyUser
 
+from .cache import get_tag_ids
+
 
 class IngredientFilter(FilterSet):
-    """Фильтр ингредиентов по их названию."""
+    """
+    Фильтр ингредиентов по их названию.
+    Используется, когда индекс автодополнения отключён; поиск по подстроке
+    опирается на триграммный GIN-индекс в PostgreSQL.
+    Порядок: точное совпадение, начало названия, начало слова, подстрока.
+    """
     name = filters.CharFilter(method='filter_name')
 
     class Meta:
@@ -14,21 +31,44 @@ class IngredientFilter(FilterSet):
         fields = ('name',)
 
     def filter_name(self, queryset, name, value):
-        return queryset.filter(
-            Q(name__istartswith=value) | Q(name__icontains=value)
-        ).annotate(
-            startswith=ExpressionWrapper(
-                Q(name__istartswith=value), output_field=BooleanField()
+        value = value.strip()
+        return queryset.filter(name__icontains=value).annotate(
+            rank=Case(
+                When(name__iexact=value, then=Value(0)),
+                When(name__istartswith=value, then=Value(1)),
+                When(
+                    Q(name__icontains=f' {value}')
+                    | Q(name__icontains=f'-{value}'),
+                    then=Value(2)
+                ),
+                default=Value(3),
+                output_field=IntegerField(),
             )
-        ).order_by('-startswith')
+        ).order_by('rank', 'name')
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class RecipeFilter(FilterSet):
     """Фильтр рецептов по автору/тегу/подписке/наличию в списке покупок."""
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug'
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_mode'
+    )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('newest', 'Сначала новые'),
+            ('popular', 'Популярные'),
+            ('trending', 'В тренде'),
+        ),
+        method='filter_ordering'
     )
     author = filters.ModelChoiceFilter(queryset=MyUser.objects.all(),)
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
@@ -38,14 +78,73 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'tags', 'tags_mode', 'is_favorited',
+            'is_in_shopping_cart', 'search', 'ordering',
+        )
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты с любым (tags_mode=any, по умолчанию) или со всеми
+        (tags_mode=all) тегами. Слаги переводятся в id по кэшу, теги
+        проверяются подзапросом к промежуточной таблице без JOIN,
+        поэтому рецепты не дублируются.
+        """
+        if not value:
+            return queryset
+        tag_ids = get_tag_ids()
+        ids = {tag_ids[slug] for slug in value}
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk')
+        )
+        if self.form.cleaned_data.get('tags_mode') != 'all':
+            return queryset.filter(Exists(recipe_tags.filter(tag_id__in=ids)))
+        for tag_id in ids:
+            queryset = queryset.filter(Exists(recipe_tags.filter(
+                tag_id=tag_id
+            )))
+        return queryset
+
+    def filter_tags_mode(self, queryset, name, value):
+        """Учитывается в filter_tags."""
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию и описанию.
+        Без параметра ordering результаты идут по релевантности.
+        """
+        if not value.strip():
+            return queryset
+        queryset = search_recipes(queryset, value)
+        if self.form.cleaned_data.get('ordering'):
+            return queryset
+        return queryset.order_by('-search_rank', '-id')
+
+    def filter_ordering(self, queryset, name, value):
+        """
+        Порядок ленты: newest — по дате публикации, popular — по числу
+        добавлений в избранное, trending — по рейтингу из RecipeRank.
+        Все порядки опираются на индексы и подходят для выдачи по курсору.
+        """
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-id')
+        if value == 'trending':
+            return queryset.annotate(
+                trending=F('rank__trending')
+            ).filter(trending__isnull=False).order_by('-trending', '-id')
+        return queryset.order_by('-pub_date', '-id')
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            )))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopcarts__user=self.request.user)
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            )))
         return queryset
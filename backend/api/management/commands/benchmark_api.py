@@ -0,0 +1,542 @@
+import random
+import statistics
+import time
+from collections import namedtuple
+from itertools import product
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.cache import UserState
+from api.paginations import RestrictPagination
+from api.renderers import FastJSONRenderer
+from api.representations import RecipeListRepresentation
+from api.serializers import RecipeListSerializer
+from api.views import RecipeViewSet
+from recipes.counters import recount
+from recipes.ingredient_index import get_ingredient_index
+from recipes.models import (
+    Amount,
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeRank,
+    ShoppingCart,
+    ShoppingCartIngredient,
+    Tag,
+)
+from recipes.search import reset_search_index, update_search_vectors
+from users.models import Follow, MyUser
+
+# latency — бюджет медианы времени ответа, мс.
+Scenario = namedtuple(
+    'Scenario',
+    ('name', 'method', 'path', 'budget', 'data', 'anonymous', 'latency'),
+    defaults=(150,),
+)
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F0C93A', 'dessert'),
+)
+
+
+class Command(BaseCommand):
+    """
+    Бенчмарк API на синтетических данных.
+    Создаёт временную тестовую базу, наполняет её пользователями,
+    рецептами и ингредиентами из ingredients.csv, прогоняет все маршруты
+    api/urls.py и сверяет число запросов к БД и медиану времени ответа
+    с бюджетами каждого сценария. Бюджеты времени рассчитаны на размер
+    данных по умолчанию; на медленной машине их увеличивает
+    --latency-scale. Завершается ошибкой, если хотя бы один сценарий
+    превысил бюджет.
+    """
+    help = 'Проверка бюджета запросов к БД и замер задержек API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=2000,
+            help='Количество пользователей в синтетических данных.'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=20000,
+            help='Количество рецептов в синтетических данных.'
+        )
+        parser.add_argument(
+            '--rounds', type=int, default=5,
+            help='Сколько раз прогонять каждый сценарий.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=2023,
+            help='Зерно генератора случайных данных.'
+        )
+        parser.add_argument(
+            '--filter', default='',
+            help='Запускать только сценарии, содержащие эту подстроку.'
+        )
+        parser.add_argument(
+            '--latency-scale', type=float, default=1.0,
+            help='Множитель бюджетов времени ответа; 0 — не проверять.'
+        )
+        parser.add_argument(
+            '--serializer-pages', type=int, default=50,
+            help='Сколько страниц ленты сериализовать для сравнения '
+                 'сериализаторов и рендереров JSON; 0 — не сравнивать.'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 10 or options['recipes'] < options['users']:
+            raise CommandError(
+                'Нужно не менее 10 пользователей и не меньше рецептов, '
+                'чем пользователей.'
+            )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher'
+            ]):
+                started = time.perf_counter()
+                context = self.seed(
+                    options['users'],
+                    options['recipes'],
+                    random.Random(options['seed'])
+                )
+                self.stdout.write(
+                    f'Данные созданы за '
+                    f'{time.perf_counter() - started:.1f} с.'
+                )
+                scenarios = [
+                    scenario for scenario in self.get_scenarios(context)
+                    if options['filter'] in scenario.name
+                ]
+                results = self.run(scenarios, context, options['rounds'])
+                read_path = None
+                if options['serializer_pages']:
+                    read_path = self.compare_read_path(
+                        context, options['serializer_pages'],
+                        options['rounds']
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if read_path is not None:
+            self.report_read_path(read_path)
+        self.report(scenarios, results, options['latency_scale'])
+
+    def seed(self, users_count, recipes_count, rng):
+        """Наполняет тестовую базу и возвращает данные для сценариев."""
+        call_command('load_csv_data', verbosity=0)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        Tag.objects.bulk_create(
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in TAGS
+        )
+        tags = list(Tag.objects.order_by('id'))
+
+        password = make_password(BENCHMARK_PASSWORD)
+        MyUser.objects.bulk_create(
+            (
+                MyUser(
+                    username=f'user{number}',
+                    email=f'user{number}@example.com',
+                    first_name=f'Имя{number}',
+                    last_name=f'Фамилия{number}',
+                    password=password,
+                ) for number in range(users_count)
+            ),
+            batch_size=1000
+        )
+        user_ids = list(MyUser.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        user = MyUser.objects.get(id=user_ids[0])
+
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=user_ids[number % users_count],
+                    name=f'Рецепт {number}',
+                    text=f'Описание рецепта {number}',
+                    cooking_time=rng.randint(1, 180),
+                    image='recipe_images/benchmark.jpg',
+                    thumbnails=[240, 480] if number % 2 else [],
+                ) for number in range(recipes_count)
+            ),
+            batch_size=1000
+        )
+        recipe_ids = list(Recipe.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        Amount.objects.bulk_create(
+            (
+                Amount(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(
+                    ingredient_ids, rng.randint(3, 10)
+                )
+            ),
+            batch_size=1000
+        )
+        recipe_tag = Recipe.tags.through
+        recipe_tag.objects.bulk_create(
+            (
+                recipe_tag(recipe_id=recipe_id, tag_id=tag.id)
+                for recipe_id in recipe_ids
+                for tag in rng.sample(tags, rng.randint(1, 2))
+            ),
+            batch_size=1000
+        )
+
+        follows = {
+            (user_id, author_id)
+            for user_id in user_ids
+            for author_id in rng.sample(user_ids, 5)
+            if author_id != user_id
+        }
+        follows.update(
+            (user.id, author_id) for author_id in rng.sample(
+                user_ids[1:], min(200, users_count - 2)
+            )
+        )
+        authors = {
+            author_id for user_id, author_id in follows if user_id == user.id
+        }
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in follows
+            ),
+            batch_size=1000
+        )
+
+        selected = rng.sample(recipe_ids, 200)
+        favorites, cart = selected[:100], selected[100:130]
+        Favorite.objects.bulk_create(
+            (Favorite(user=user, recipe_id=pk) for pk in favorites),
+            batch_size=1000
+        )
+        ShoppingCart.objects.bulk_create(
+            (ShoppingCart(user=user, recipe_id=pk) for pk in cart),
+            batch_size=1000
+        )
+        ShoppingCartIngredient.objects.rebuild([user.id])
+        recount()
+        RecipeRank.objects.rebuild()
+        update_search_vectors()
+        reset_search_index()
+        return {
+            'user': user,
+            'author': next(pk for pk in user_ids[1:] if pk not in authors),
+            'followed': min(authors),
+            'recipe': selected[-1],
+            'batch': selected[130:150],
+            'own_recipe': Recipe.objects.filter(author=user).first().id,
+            'ingredients': rng.sample(ingredient_ids, 8),
+            'tags': tags,
+            'query': 'мол',
+            'deep_page': max(recipes_count // 6 // 2, 1),
+        }
+
+    def get_scenarios(self, context):
+        """Сценарии в порядке выполнения с бюджетами запросов к БД."""
+        user = context['user']
+        tags = context['tags']
+        recipe = context['recipe']
+        author = context['author']
+        batch = {'recipes': context['batch']}
+        scenarios = [
+            Scenario('users list', 'get', '/api/users/?limit=6', 4,
+                     None, False),
+            Scenario('users list (anonymous)', 'get', '/api/users/?limit=50',
+                     2, None, True),
+            Scenario('users detail', 'get', f'/api/users/{author}/', 2,
+                     None, False),
+            Scenario('users me', 'get', '/api/users/me/', 1, None, False),
+            Scenario('subscriptions', 'get',
+                     '/api/users/subscriptions/?limit=6', 3, None, False),
+            Scenario('subscriptions recipes_limit', 'get',
+                     '/api/users/subscriptions/?limit=6&recipes_limit=1',
+                     3, None, False),
+            Scenario('subscribe', 'post', f'/api/users/{author}/subscribe/',
+                     6, None, False),
+            Scenario('unsubscribe', 'delete',
+                     f'/api/users/{author}/subscribe/', 6, None, False),
+            Scenario('tags list', 'get', '/api/tags/', 1, None, True),
+            Scenario('tags detail', 'get', f'/api/tags/{tags[0].id}/', 1,
+                     None, True),
+            Scenario('ingredients list', 'get', '/api/ingredients/', 1,
+                     None, True),
+            Scenario('ingredients search', 'get',
+                     f'/api/ingredients/?name={context["query"]}', 1,
+                     None, True),
+            Scenario('ingredients detail', 'get',
+                     f'/api/ingredients/{context["ingredients"][0]}/', 1,
+                     None, True),
+            Scenario('recipes list page 6', 'get', '/api/recipes/?limit=6',
+                     5, None, False),
+            Scenario('recipes list page 50', 'get', '/api/recipes/?limit=50',
+                     5, None, False),
+            Scenario('recipes list deep page', 'get',
+                     f'/api/recipes/?limit=6&page={context["deep_page"]}', 5,
+                     None, False),
+            Scenario('recipes list cursor', 'get',
+                     '/api/recipes/?limit=6&cursor=&count=1', 5, None,
+                     False),
+            Scenario('recipes list popular', 'get',
+                     '/api/recipes/?limit=6&ordering=popular', 5, None,
+                     False),
+            Scenario('recipes list trending', 'get',
+                     '/api/recipes/?limit=6&ordering=trending&cursor=', 5,
+                     None, False),
+            Scenario('recipes search', 'get',
+                     '/api/recipes/?limit=6&search=рецепт', 5, None, False,
+                     # Без PostgreSQL: индекс в памяти перестраивается
+                     # после изменения рецепта в каждом круге.
+                     1000),
+            Scenario('recipes can_cook', 'get',
+                     '/api/recipes/can_cook/?limit=6&ingredients='
+                     + ','.join(map(str, context['ingredients'][:5])),
+                     5, None, False),
+            Scenario('recipes list (anonymous)', 'get',
+                     '/api/recipes/?limit=6', 4, None, True),
+            Scenario('recipes detail', 'get', f'/api/recipes/{recipe}/', 3,
+                     None, False),
+            Scenario('recipes detail (anonymous)', 'get',
+                     f'/api/recipes/{recipe}/', 3, None, True),
+            Scenario('favorite add', 'post',
+                     f'/api/recipes/{recipe}/favorite/', 6, None, False),
+            Scenario('favorite remove', 'delete',
+                     f'/api/recipes/{recipe}/favorite/', 6, None, False),
+            Scenario('shopping_cart add', 'post',
+                     f'/api/recipes/{recipe}/shopping_cart/', 12, None,
+                     False),
+            Scenario('shopping_cart remove', 'delete',
+                     f'/api/recipes/{recipe}/shopping_cart/', 12, None,
+                     False),
+            Scenario('favorite batch add', 'post',
+                     '/api/recipes/favorite/', 6, batch, False),
+            Scenario('favorite batch remove', 'delete',
+                     '/api/recipes/favorite/', 6, batch, False),
+            Scenario('shopping_cart batch add', 'post',
+                     '/api/recipes/shopping_cart/', 13, batch, False),
+            Scenario('shopping_cart batch remove', 'delete',
+                     '/api/recipes/shopping_cart/', 13, batch, False),
+            Scenario('download_shopping_cart', 'get',
+                     '/api/recipes/download_shopping_cart/', 2, None, False),
+            Scenario('download_shopping_cart csv', 'get',
+                     '/api/recipes/download_shopping_cart/?format=csv', 2,
+                     None, False),
+            Scenario('download_shopping_cart json', 'get',
+                     '/api/recipes/download_shopping_cart/?format=json', 2,
+                     None, False),
+            Scenario('recipes update', 'patch',
+                     f'/api/recipes/{context["own_recipe"]}/', 26, {
+                         'ingredients': [
+                             {'id': pk, 'amount': 10}
+                             for pk in context['ingredients'][:5]
+                         ],
+                         'tags': [tag.id for tag in tags[:2]],
+                         'name': 'Обновлённый рецепт',
+                         'text': 'Новое описание',
+                         'cooking_time': 30,
+                     }, False),
+            Scenario('auth token login', 'post', '/api/auth/token/login/',
+                     5, {'email': user.email,
+                         'password': BENCHMARK_PASSWORD}, True),
+            Scenario('auth token logout', 'post', '/api/auth/token/logout/',
+                     2, None, False),
+        ]
+        filters = product(
+            (None, f'author={context["followed"]}'),
+            (None, f'tags={tags[0].slug}',
+             f'tags={tags[0].slug}&tags={tags[1].slug}',
+             f'tags={tags[0].slug}&tags={tags[1].slug}&tags_mode=all'),
+            (None, 'is_favorited=1'),
+            (None, 'is_in_shopping_cart=1'),
+        )
+        for combination in filters:
+            params = [param for param in combination if param]
+            if not params:
+                continue
+            budget = 5 + bool(combination[0])
+            scenarios.append(Scenario(
+                f'recipes filter {"&".join(params)}', 'get',
+                f'/api/recipes/?limit=6&{"&".join(params)}',
+                budget, None, False
+            ))
+        return scenarios
+
+    def run(self, scenarios, context, rounds):
+        """Выполняет сценарии, собирая число запросов и задержки."""
+        client = APIClient()
+        client.force_authenticate(context['user'])
+        anonymous = APIClient()
+        results = {
+            scenario.name: {'queries': 0, 'timings': [], 'statuses': set()}
+            for scenario in scenarios
+        }
+        for _ in range(rounds):
+            for scenario in scenarios:
+                api = anonymous if scenario.anonymous else client
+                if not scenario.anonymous:
+                    # Бюджеты считаются при загруженном UserState, иначе
+                    # его загрузка достаётся первому сценарию с токеном.
+                    UserState.load(context['user'].id)
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(api, scenario.method)(
+                        scenario.path, data=scenario.data, format='json'
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                result = results[scenario.name]
+                result['queries'] = max(result['queries'], len(queries))
+                result['timings'].append(elapsed * 1000)
+                result['statuses'].add(response.status_code)
+        return results
+
+    def compare_read_path(self, context, pages, rounds):
+        """
+        Процессорное время чтения ленты: сериализаторы DRF против
+        api.representations и JSONRenderer против FastJSONRenderer на
+        страницах ленты (по 6 рецептов) и полном списке ингредиентов.
+        Страницы загружаются заранее, замеряется только преобразование.
+        Возвращает [(название, вариант A, вариант B, мс A, мс B,
+        число наборов данных с разным JSON)].
+        """
+        serializer_context = {
+            'user_state': UserState.load(context['user'].id)
+        }
+        queryset = RecipeViewSet().get_queryset().order_by('-pub_date', '-id')
+        page_size = RestrictPagination.page_size
+        feed = [
+            list(queryset[number * page_size:(number + 1) * page_size])
+            for number in range(pages)
+        ]
+        feed = [page for page in feed if page]
+        feed_data = [
+            RecipeListRepresentation(
+                page, many=True, context=serializer_context
+            ).data
+            for page in feed
+        ]
+        ingredients = [get_ingredient_index().search('')]
+        json_renderer = JSONRenderer()
+        fast_renderer = FastJSONRenderer()
+
+        def serialize(serializer_class):
+            return lambda page: json_renderer.render(serializer_class(
+                page, many=True, context=serializer_context
+            ).data)
+
+        comparisons = (
+            ('Сериализация страницы ленты', feed,
+             ('DRF', serialize(RecipeListSerializer)),
+             ('api.representations', serialize(RecipeListRepresentation))),
+            ('JSON страницы ленты', feed_data,
+             ('JSONRenderer', json_renderer.render),
+             ('FastJSONRenderer', fast_renderer.render)),
+            ('JSON списка ингредиентов', ingredients,
+             ('JSONRenderer', json_renderer.render),
+             ('FastJSONRenderer', fast_renderer.render)),
+        )
+        results = []
+        for title, payloads, (name_a, render_a), (name_b, render_b) in (
+            comparisons
+        ):
+            timings_a, timings_b = [], []
+            mismatches = 0
+            for _ in range(rounds):
+                for payload in payloads:
+                    started = time.process_time()
+                    content_a = render_a(payload)
+                    timings_a.append((time.process_time() - started) * 1000)
+                    started = time.process_time()
+                    content_b = render_b(payload)
+                    timings_b.append((time.process_time() - started) * 1000)
+                    mismatches += content_a != content_b
+            results.append((
+                title, name_a, name_b,
+                statistics.mean(timings_a), statistics.mean(timings_b),
+                mismatches,
+            ))
+        return results
+
+    def report_read_path(self, results):
+        failures = []
+        for title, name_a, name_b, time_a, time_b, mismatches in results:
+            self.stdout.write(
+                f'{title}, процессорное время: {name_a} {time_a:.2f} мс, '
+                f'{name_b} {time_b:.2f} мс '
+                f'(в {time_a / max(time_b, 1e-6):.1f} раза быстрее).'
+            )
+            if mismatches:
+                failures.append(f'{title}: {mismatches}')
+        if failures:
+            raise CommandError(
+                'JSON вариантов различается: ' + ', '.join(failures)
+            )
+
+    def report(self, scenarios, results, latency_scale):
+        """Печатает таблицу результатов и сообщает о превышениях."""
+        self.stdout.write(
+            f'{"сценарий":<88}{"запросы":>10}'
+            f'{"p50, мс":>16}{"p95, мс":>10}{"p99, мс":>10}  статус'
+        )
+        failures = []
+        for scenario in scenarios:
+            result = results[scenario.name]
+            timings = result['timings']
+            if len(timings) > 1:
+                percentiles = statistics.quantiles(timings, n=100)
+                p50, p95, p99 = (percentiles[index] for index in (49, 94, 98))
+            else:
+                p50 = p95 = p99 = timings[0]
+            statuses = ','.join(map(str, sorted(result['statuses'])))
+            latency = scenario.latency * latency_scale
+            line = (
+                f'{scenario.name:<88}'
+                f'{result["queries"]:>5}/{scenario.budget:<4}'
+                f'{p50:>10.1f}/{latency:<5.0f}{p95:>10.1f}{p99:>10.1f}'
+                f'  {statuses}'
+            )
+            if (
+                result['queries'] > scenario.budget
+                or (latency and p50 > latency)
+                or any(status >= 400 for status in result['statuses'])
+            ):
+                failures.append(scenario.name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if failures:
+            raise CommandError(
+                'Превышен бюджет запросов или времени ответа или получена '
+                'ошибка: '
+                + ', '.join(failures)
+            )
+        self.stdout.write(
+            self.style.SUCCESS('Все сценарии уложились в бюджет.')
+        )
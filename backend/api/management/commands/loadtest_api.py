@@ -0,0 +1,126 @@
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+INGREDIENT_QUERIES = ('а', 'мо', 'сах', 'кар', 'сол', 'пер', 'мук', 'яй')
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный тест запущенного сервера по горячим маршрутам чтения:
+    лента и карточка рецепта, теги, автодополнение ингредиентов и
+    подписки (если задан токен). Запросы идут параллельно из
+    --concurrency потоков; для каждого маршрута выводятся запросы в
+    секунду, перцентили задержки и число ошибок. Так сравниваются
+    режимы WSGI и ASGI (ASGI_MODE) на одних и тех же данных.
+    """
+    help = 'Нагрузочный тест горячих маршрутов запущенного сервера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='Адрес сервера.'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=1000,
+            help='Сколько запросов отправить на каждый маршрут.'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=32,
+            help='Число одновременных запросов.'
+        )
+        parser.add_argument(
+            '--token', default='',
+            help='Токен пользователя; без него подписки не проверяются.'
+        )
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        self.headers = {'Accept': 'application/json'}
+        if options['token']:
+            self.headers['Authorization'] = f'Token {options["token"]}'
+        try:
+            recipes = json.loads(self.fetch('/api/recipes/?limit=50')[1])
+        except (URLError, ValueError) as error:
+            raise CommandError(f'Сервер {self.url} недоступен: {error}')
+        recipe_ids = [recipe['id'] for recipe in recipes['results']]
+        if not recipe_ids:
+            raise CommandError('На сервере нет рецептов.')
+        slugs = [tag['slug'] for tag in json.loads(
+            self.fetch('/api/tags/')[1]
+        )] or ['']
+        scenarios = [
+            ('recipes list', lambda number: '/api/recipes/?limit=6'),
+            ('recipes list by tag', lambda number: (
+                f'/api/recipes/?limit=6&tags={slugs[number % len(slugs)]}'
+            )),
+            ('recipe detail', lambda number: (
+                f'/api/recipes/{recipe_ids[number % len(recipe_ids)]}/'
+            )),
+            ('tags', lambda number: '/api/tags/'),
+            ('ingredients autocomplete', lambda number: (
+                '/api/ingredients/?limit=10&name='
+                + quote(INGREDIENT_QUERIES[number % len(INGREDIENT_QUERIES)])
+            )),
+        ]
+        if options['token']:
+            scenarios.append((
+                'subscriptions',
+                lambda number: '/api/users/subscriptions/?recipes_limit=3',
+            ))
+        self.stdout.write(
+            f'{"Маршрут":<26}{"запр/с":>9}{"p50, мс":>10}{"p95, мс":>10}'
+            f'{"p99, мс":>10}{"ошибки":>8}'
+        )
+        for name, get_path in scenarios:
+            rps, timings, errors = self.run(
+                get_path, options['requests'], options['concurrency']
+            )
+            quantiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f'{name:<26}{rps:>9.0f}{quantiles[49]:>10.1f}'
+                f'{quantiles[94]:>10.1f}{quantiles[98]:>10.1f}{errors:>8}'
+            )
+
+    def fetch(self, path):
+        """Статус и тело ответа на GET path."""
+        request = Request(self.url + path, headers=self.headers)
+        try:
+            with urlopen(request, timeout=30) as response:
+                return response.status, response.read()
+        except HTTPError as error:
+            return error.code, error.read()
+
+    def timed_fetch(self, path):
+        started = time.perf_counter()
+        try:
+            status = self.fetch(path)[0]
+        except (URLError, OSError):
+            status = None
+        return (time.perf_counter() - started) * 1000, status == 200
+
+    def run(self, get_path, requests, concurrency):
+        """Запросы в секунду, задержки в мс и число неуспешных ответов."""
+        # Прогрев: кэши и индекс ингредиентов в каждом воркере.
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(
+                self.timed_fetch, map(get_path, range(concurrency * 2))
+            ))
+        numbers = count()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(
+                lambda _: self.timed_fetch(get_path(next(numbers))),
+                range(requests)
+            ))
+        elapsed = time.perf_counter() - started
+        timings = [timing for timing, _ in results]
+        errors = sum(not ok for _, ok in results)
+        return requests / elapsed, timings, errors
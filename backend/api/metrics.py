@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUESTS = Counter(
+    'foodgram_http_requests_total',
+    'Число обработанных запросов.',
+    ('method', 'route', 'status'),
+)
+LATENCY = Histogram(
+    'foodgram_http_request_duration_seconds',
+    'Время обработки запроса.',
+    ('method', 'route'),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    'foodgram_http_request_db_queries',
+    'Число запросов к БД за один запрос к API.',
+    ('method', 'route'),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests_total',
+    'Обращения к кэшу: hit — найдено, miss — посчитано заново.',
+    ('cache', 'result'),
+)
+
+_query_counter = ContextVar('query_counter', default=None)
+
+
+def get_route(request):
+    """
+    Маршрут для метки: имя URL (recipes-list, users-subscriptions,
+    login), а не путь, чтобы id не плодили ряды метрик.
+    """
+    match = request.resolver_match
+    if match is None or not match.view_name:
+        return 'unmatched'
+    return match.view_name
+
+
+class QueryCounter:
+    """Считает запросы к БД; подключается через execute_wrapper."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def count_queries():
+    """
+    Подключает счётчик текущего запроса к соединению этого потока.
+    Под ASGI представления выполняются не в том потоке, где работает
+    MetricsMiddleware (см. api.async_views), и запросы к БД считаются
+    через этот контекстный менеджер.
+    """
+    counter = _query_counter.get()
+    if counter is None:
+        return nullcontext()
+    return connection.execute_wrapper(counter)
+
+
+class MetricsMiddleware:
+    """
+    Число запросов, время ответа и число запросов к БД по маршрутам.
+    Работает и под WSGI, и под ASGI. Выключается METRICS_ENABLED=False.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self.observe(request, response, started, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryCounter()
+        started = time.perf_counter()
+        token = _query_counter.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        self.observe(request, response, started, queries)
+        return response
+
+    @staticmethod
+    def observe(request, response, started, queries):
+        elapsed = time.perf_counter() - started
+        route = get_route(request)
+        REQUESTS.labels(request.method, route, response.status_code).inc()
+        LATENCY.labels(request.method, route).observe(elapsed)
+        DB_QUERIES.labels(request.method, route).observe(queries.count)
+
+
+def render_metrics():
+    """
+    Метрики в текстовом формате Prometheus. Под gunicorn с несколькими
+    воркерами (PROMETHEUS_MULTIPROC_DIR, см. gunicorn.conf.py) значения
+    собираются из файлов всех воркеров.
+    """
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
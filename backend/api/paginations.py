@@ -1,6 +1,197 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class RestrictPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+def approximate_count(queryset):
+    """
+    Оценка числа строк по плану запроса PostgreSQL без COUNT(*).
+    На остальных СУБД выполняется обычный COUNT(*).
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(RestrictPagination):
+    """
+    Постраничная выдача по ключу вместо номера страницы.
+    Включается параметром cursor (пустой — первая страница): записи
+    выбираются условием по полям ordering от последней показанной,
+    без OFFSET и COUNT(*), поэтому глубокие страницы не медленнее первой.
+    Курсоры next и previous непрозрачны. Приблизительное число записей
+    добавляется в ответ по параметру count=1.
+    Ключ — порядок, заданный выборке через order_by(), или ordering.
+    Без cursor работает обычная выдача по page и limit.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    # Последнее поле должно быть уникальным.
+    ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.key = self.ordering
+        if queryset.query.order_by and all(
+            isinstance(field, str) for field in queryset.query.order_by
+        ):
+            self.key = tuple(queryset.query.order_by)
+        position, reverse = self.decode_cursor(
+            queryset.model, request.query_params[self.cursor_query_param]
+        )
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = approximate_count(queryset)
+
+        ordering = self.key
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        # Лишняя запись показывает, есть ли следующая страница.
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.results = results
+        return results
+
+    def after(self, ordering, position):
+        """Условие «строго после position» для заданного порядка."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, instance):
+        position = []
+        for field in self.key:
+            value = getattr(instance, field.lstrip('-'))
+            position.append(
+                value if isinstance(value, (int, float)) else str(value)
+            )
+        return position
+
+    def encode_cursor(self, position, reverse):
+        cursor = json.dumps({'p': position, 'r': int(reverse)})
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            urlsafe_b64encode(cursor.encode()).decode(),
+        )
+
+    def decode_cursor(self, model, cursor):
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(cursor.encode()))
+            position = [
+                self.parse_value(model, field.lstrip('-'), value)
+                for field, value in zip(self.key, data['p'])
+            ]
+            reverse = bool(data['r'])
+        except (
+            BinasciiError, ValueError, TypeError, KeyError, ValidationError
+        ):
+            raise NotFound('Неверный курсор.')
+        if len(position) != len(self.key):
+            raise NotFound('Неверный курсор.')
+        return position, reverse
+
+    def parse_value(self, model, name, value):
+        """Значение ключа из курсора; аннотации должны быть числами."""
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if not isinstance(value, (int, float)):
+                raise ValueError(value)
+            return value
+        return field.to_python(value)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.results:
+            return None
+        return self.encode_cursor(self.get_position(self.results[-1]), False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.results:
+            return remove_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param
+            )
+        return self.encode_cursor(self.get_position(self.results[0]), True)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы; пустой — первая страница.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Добавить приблизительное число записей.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class SubscriptionPagination(KeysetPagination):
+    """Подписки по id автора."""
+    ordering = ('id',)
@@ -0,0 +1,348 @@
+import asyncio
+import cProfile
+import hashlib
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework import serializers
+
+# Верхние границы корзин гистограммы времени ответа, мс.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+# Сколько самых частых повторяющихся запросов хранить на endpoint.
+TOP_REPEATED = 5
+
+_current = ContextVar('request_profile', default=None)
+# cProfile в процессе может работать только один.
+_profiler_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    """Отпечаток запроса: SQL с плейсхолдерами без значений параметров."""
+    return hashlib.md5(sql.encode()).hexdigest()[:12]
+
+
+class RequestProfile:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoint = None
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.queries = Counter()
+        self.samples = {}
+        self.in_serializer = False
+        # cProfile выборки; запускается в потоке представления.
+        self.profiler = None
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def repeated(self):
+        """{отпечаток: число выполнений} для запросов, выполненных повторно."""
+        return {
+            key: count for key, count in self.queries.items() if count > 1
+        }
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обёртка выполнения запроса для connection.execute_wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            key = fingerprint(sql)
+            self.queries[key] += 1
+            self.samples.setdefault(key, sql[:300])
+
+    def server_timing(self, total):
+        repeated = sum(self.repeated.values())
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};'
+            f'desc="{self.query_count} queries, {repeated} repeated"',
+            f'serializer;dur={self.serializer_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+class ProfileStore:
+    """Сводка замеров по endpoint в памяти процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = defaultdict(lambda: {
+                'requests': 0,
+                'buckets': [0] * len(BUCKETS),
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'db_ms': 0.0,
+                'serializer_ms': 0.0,
+                'render_ms': 0.0,
+                'queries': 0,
+                'max_queries': 0,
+                'repeated': Counter(),
+                'samples': {},
+            })
+
+    def add(self, profile, total):
+        total_ms = total * 1000
+        with self.lock:
+            stats = self.endpoints[profile.endpoint]
+            stats['requests'] += 1
+            stats['buckets'][bisect_left(BUCKETS, total_ms)] += 1
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['db_ms'] += profile.db_time * 1000
+            stats['serializer_ms'] += profile.serializer_time * 1000
+            stats['render_ms'] += profile.render_time * 1000
+            stats['queries'] += profile.query_count
+            stats['max_queries'] = max(
+                stats['max_queries'], profile.query_count
+            )
+            for key, count in profile.repeated.items():
+                stats['repeated'][key] += count
+                stats['samples'].setdefault(key, profile.samples[key])
+
+    def snapshot(self):
+        """Сводка для API: средние значения и гистограмма по endpoint."""
+        with self.lock:
+            result = {}
+            for endpoint, stats in sorted(self.endpoints.items()):
+                requests = stats['requests']
+                result[endpoint] = {
+                    'requests': requests,
+                    'avg_ms': round(stats['total_ms'] / requests, 2),
+                    'max_ms': round(stats['max_ms'], 2),
+                    'avg_db_ms': round(stats['db_ms'] / requests, 2),
+                    'avg_serializer_ms': round(
+                        stats['serializer_ms'] / requests, 2
+                    ),
+                    'avg_render_ms': round(stats['render_ms'] / requests, 2),
+                    'avg_queries': round(stats['queries'] / requests, 2),
+                    'max_queries': stats['max_queries'],
+                    'histogram': {
+                        str(bound): count for bound, count in zip(
+                            BUCKETS, stats['buckets']
+                        )
+                    },
+                    'repeated_queries': [
+                        {
+                            'fingerprint': key,
+                            'count': count,
+                            'sql': stats['samples'][key],
+                        }
+                        for key, count in stats['repeated'].most_common(
+                            TOP_REPEATED
+                        )
+                    ],
+                }
+            return result
+
+
+store = ProfileStore()
+
+
+def get_endpoint(request, view_func):
+    """Имя endpoint: ViewSet.action для DRF, путь к функции для остальных."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__qualname__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+@contextmanager
+def serializer_timer():
+    """
+    Время сериализации; вложенные вызовы .data входят во внешний.
+    Без профиля текущего запроса ничего не замеряет.
+    """
+    profile = _current.get()
+    if profile is None or profile.in_serializer:
+        yield
+        return
+    profile.in_serializer = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serializer_time += time.perf_counter() - started
+        profile.in_serializer = False
+
+
+def patch_serializer_data():
+    """
+    Замеряет BaseSerializer.data: через него получают данные и
+    Serializer, и ListSerializer, поэтому сериализаторы проекта
+    менять не нужно.
+    """
+    data = serializers.BaseSerializer.data
+    if getattr(data.fget, 'profiled', False):
+        return
+
+    def profiled_data(self):
+        with serializer_timer():
+            return data.fget(self)
+
+    profiled_data.profiled = True
+    serializers.BaseSerializer.data = property(profiled_data)
+
+
+@contextmanager
+def render_timer():
+    """Время отрисовки ответа; без профиля запроса ничего не замеряет."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.render_time += time.perf_counter() - started
+
+
+@contextmanager
+def profile_thread():
+    """
+    Подключает профиль текущего запроса к соединению с БД и cProfile
+    этого потока. Под ASGI представления выполняются не в том потоке,
+    где работает ProfilingMiddleware (см. api.async_views), и замеры
+    подключаются там через этот контекстный менеджер.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    profiler = profile.profiler
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Профилировщик уже запущен вне middleware.
+            profiler = None
+    try:
+        with connection.execute_wrapper(profile):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+
+class ProfilingMiddleware:
+    """
+    Замеры запросов, включается PROFILING_ENABLED: общее время, время
+    и число запросов к БД, повторяющиеся запросы, время сериализации и
+    отрисовки ответа.
+    Результат отдаётся в заголовке Server-Timing и копится в store по
+    endpoint. Доля PROFILING_SAMPLE_RATE запросов выполняется под
+    cProfile, профиль запросов дольше PROFILING_SLOW_MS сохраняется в
+    PROFILING_DIR. Работает и под WSGI, и под ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        patch_serializer_data()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = self.start(request)
+        token = _current.set(profile)
+        try:
+            with profile_thread():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            self.stop_profiler(profile)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = self.start(request)
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+            self.stop_profiler(profile)
+        return self.finish(request, response, profile)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current.get()
+        if profile is not None:
+            profile.endpoint = get_endpoint(request, view_func)
+
+    def process_template_response(self, request, response):
+        """Замеряет отрисовку ответа DRF в JSON и другие форматы."""
+        render = response.render
+
+        def timed_render():
+            with render_timer():
+                return render()
+
+        response.render = timed_render
+        return response
+
+    @staticmethod
+    def start(request):
+        profile = RequestProfile()
+        if (
+            random.random() < settings.PROFILING_SAMPLE_RATE
+            and _profiler_lock.acquire(blocking=False)
+        ):
+            profile.profiler = cProfile.Profile()
+        return profile
+
+    @staticmethod
+    def stop_profiler(profile):
+        if profile.profiler is not None:
+            _profiler_lock.release()
+
+    def finish(self, request, response, profile):
+        total = time.perf_counter() - profile.started
+        if profile.endpoint is None:
+            profile.endpoint = f'{request.method} {request.path_info}'
+        store.add(profile, total)
+        response['Server-Timing'] = profile.server_timing(total)
+        if (
+            profile.profiler is not None
+            and total * 1000 >= settings.PROFILING_SLOW_MS
+            and profile.profiler.getstats()
+        ):
+            self.dump(profile.profiler, profile.endpoint)
+        return response
+
+    @staticmethod
+    def dump(profiler, endpoint):
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        name = f'{endpoint}-{time.time_ns() // 1000}-{os.getpid()}'
+        profiler.dump_stats(os.path.join(
+            settings.PROFILING_DIR,
+            f'{"".join(c if c.isalnum() else "_" for c in name)}.prof'
+        ))
@@ -0,0 +1,209 @@
+import csv
+import json
+
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Как в JSONRenderer: эти символы экранируются, чтобы JSON можно было
+# встроить в JavaScript.
+LINE_SEPARATORS = (
+    ('\u2028'.encode(), b'\\u2028'),
+    ('\u2029'.encode(), b'\\u2029'),
+)
+
+
+class JSONFragment:
+    """
+    Готовый JSON (bytes), который рендерер вставляет в ответ как есть,
+    без разбора и повторного кодирования. Хранится в кэше вместо данных.
+    """
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content
+
+    def __getstate__(self):
+        return self.content
+
+    def __setstate__(self, state):
+        self.content = state
+
+
+class FragmentJSONEncoder(JSONEncoder):
+    """Кодировщик json для запасного пути: фрагменты разбираются."""
+
+    def default(self, obj):
+        if isinstance(obj, JSONFragment):
+            return json.loads(obj.content)
+        return super().default(obj)
+
+
+_encoder = JSONEncoder()
+
+
+def orjson_default(obj):
+    if isinstance(obj, JSONFragment):
+        return orjson.Fragment(obj.content)
+    return _encoder.default(obj)
+
+
+def encode_json(data):
+    """JSON в том же виде, что отдаёт FastJSONRenderer."""
+    return FastJSONRenderer().render(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson, если он установлен, с тем же результатом:
+    компактный UTF-8, даты и Decimal кодируются как в DRF.
+    Без orjson, с отступами (indent) или с данными, которые orjson не
+    поддерживает, работает обычный JSONRenderer.
+    Поддерживает JSONFragment.
+    """
+    encoder_class = FragmentJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(
+            accepted_media_type, renderer_context or {}
+        ):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        try:
+            content = orjson.dumps(
+                data,
+                default=orjson_default,
+                option=orjson.OPT_NON_STR_KEYS
+                | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        for character, escaped in LINE_SEPARATORS:
+            if character in content:
+                content = content.replace(character, escaped)
+        return content
+
+
+class Echo:
+    """Псевдо-буфер: csv.writer пишет в него, а строка сразу возвращается."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+    Список отдаётся потоком: stream() выдаёт документ по частям,
+    не собирая его целиком в памяти.
+    Обычные ответы (ошибки, пустой список) выводятся через render().
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = '\n'.join(str(value) for value in data.values())
+        return str(data).encode(self.charset)
+
+    def stream(self, user, ingredients):
+        yield self.header(user)
+        for ingredient in ingredients:
+            yield self.row(ingredient)
+        yield self.footer(user)
+
+    def header(self, user):
+        return ''
+
+    def row(self, ingredient):
+        raise NotImplementedError('Метод row() должен быть переопределён.')
+
+    def footer(self, user):
+        return ''
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в виде текстового файла."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def header(self, user):
+        return (
+            f'Список покупок\n\n'
+            f'Загрузил пользователь:{user.username}\n'
+            f'Создан: {timezone.now().strftime("%d/%m/%Y %H:%M")}\n\n'
+        )
+
+    def row(self, ingredient):
+        return (
+            f'{ingredient["name"]} --- '
+            f'{ingredient["amount"]} {ingredient["measurement_unit"]}\n'
+        )
+
+    def footer(self, user):
+        return '\nБэкенд проекта разработал Антон Корчагин'
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def __init__(self):
+        self.writer = csv.writer(Echo())
+
+    def header(self, user):
+        return self.writer.writerow(('name', 'amount', 'measurement_unit'))
+
+    def row(self, ingredient):
+        return self.writer.writerow((
+            ingredient['name'],
+            ingredient['amount'],
+            ingredient['measurement_unit'],
+        ))
+
+
+class JsonShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, user, ingredients):
+        yield '{"user": %s, "ingredients": [' % json.dumps(
+            user.username, ensure_ascii=False
+        )
+        separator = ''
+        for ingredient in ingredients:
+            yield separator + self.row(ingredient)
+            separator = ', '
+        yield ']}'
+
+    def row(self, ingredient):
+        return json.dumps({
+            'name': ingredient['name'],
+            'measurement_unit': ingredient['measurement_unit'],
+            'amount': ingredient['amount'],
+        }, ensure_ascii=False)
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CsvShoppingListRenderer,
+    JsonShoppingListRenderer,
+)
@@ -1,5 +1,7 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
 from recipes.models import (
@@ -8,14 +10,20 @@ from recipes.models import (
     Ingredient,
     Recipe,
     ShoppingCart,
+    ShoppingCartIngredient,
     Tag,
 )
+from recipes.thumbnails import get_srcset
 from users.models import MyUser
 
+from .cache import get_user_state
+from .fields import StreamingBase64ImageField
+
 
 class SmallRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор краткого отображения рецепта"""
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -23,6 +31,7 @@ class SmallRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time'
         )
         read_only_fields = ['__all__']
@@ -32,8 +41,24 @@ class SmallRecipeSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
 
+    def get_image_srcset(self, obj):
+        return get_srcset(obj)
+
+
+class UserStateMixin:
+    """
+    Избранное, список покупок и подписки пользователя запроса.
+    Контекст может передать готовое состояние в ключе user_state.
+    """
+
+    @property
+    def user_state(self):
+        if 'user_state' in self.context:
+            return self.context['user_state']
+        return get_user_state(self.context.get('request'))
+
 
-class MyUserSerializer(UserSerializer):
+class MyUserSerializer(UserStateMixin, UserSerializer):
     """Сериализатор отображения информации о пользователе."""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
@@ -45,47 +70,51 @@ class MyUserSerializer(UserSerializer):
             'username',
             'first_name',
             'last_name',
-            'is_subscribed'
+            'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return obj.followings.filter(user=user).exists()
+        return obj.id in self.user_state.following
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(UserStateMixin, serializers.ModelSerializer):
     """Сериализатор управления подписками."""
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta(MyUserSerializer.Meta):
         fields = [
             *MyUserSerializer.Meta.fields,
             'recipes',
-            'recipes_count'
         ]
         read_only_fields = ['__all__']
 
+    @staticmethod
+    def get_recipes_limit(request):
+        """Количество рецептов автора из параметра recipes_limit."""
+        try:
+            limit = int(request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return settings.RECIPES_LIMIT
+        return max(limit, 0)
+
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return obj.followings.filter(user=user).exists()
+        return obj.id in self.user_state.following
 
     def get_recipes(self, obj):
-        recipes = obj.recipes.all()[:3]
+        if hasattr(obj, 'recent_recipes'):
+            recipes = obj.recent_recipes
+        else:
+            limit = self.get_recipes_limit(self.context.get('request'))
+            recipes = obj.recipes.all()[:limit]
         return SmallRecipeSerializer(
             recipes,
             many=True,
             context=self.context
         ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для тегов."""
@@ -116,13 +145,14 @@ class AmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(UserStateMixin, serializers.ModelSerializer):
     """Сериализатор для отображения рецептов."""
     author = MyUserSerializer(read_only=True)
     image = serializers.SerializerMethodField(
         'get_image',
         read_only=True,
     )
+    image_srcset = serializers.SerializerMethodField(read_only=True)
     ingredients = serializers.SerializerMethodField(read_only=True)
     tags = TagSerializer(read_only=True, many=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
@@ -137,8 +167,11 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'ingredients',
             'is_favorited',
             'is_in_shopping_cart',
+            'favorites_count',
+            'shopping_count',
             'name',
             'image',
+            'image_srcset',
             'text',
             'cooking_time',
         )
@@ -149,38 +182,78 @@ class RecipeListSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
 
+    def get_image_srcset(self, obj):
+        return get_srcset(obj)
+
     def get_ingredients(self, obj):
         queryset = obj.amounts.all()
         return AmountSerializer(queryset, many=True).data
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return obj.favorites.filter(user=user).exists()
+        return obj.id in self.user_state.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return obj.shopcarts.filter(user=user).exists()
+        return obj.id in self.user_state.cart
+
+
+class CookableRecipeSerializer(RecipeListSerializer):
+    """Рецепт с долей ингредиентов, которые есть у пользователя."""
+    coverage = serializers.FloatField(read_only=True)
+    ingredients_matched = serializers.IntegerField(read_only=True)
+    ingredients_total = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = (
+            *RecipeListSerializer.Meta.fields,
+            'coverage',
+            'ingredients_matched',
+            'ingredients_total',
+        )
+
+
+class AddIngredientListSerializer(serializers.ListSerializer):
+    """Список ингредиентов рецепта: все id проверяются одним запросом."""
+    default_error_messages = {
+        'does_not_exist': 'Недопустимый первичный ключ "{pk_value}" - '
+                          'объект не существует.',
+    }
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            {item['id'] for item in items}
+        )
+        errors = []
+        for item in items:
+            ingredient = ingredients.get(item['id'])
+            if ingredient is None:
+                errors.append({'id': [
+                    self.error_messages['does_not_exist'].format(
+                        pk_value=item['id']
+                    )
+                ]})
+            else:
+                item['id'] = ingredient
+                errors.append({})
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
 
 
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления ингредиента."""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
         model = Amount
         fields = ('id', 'amount')
+        list_serializer_class = AddIngredientListSerializer
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для изменения рецепта."""
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
     author = MyUserSerializer(read_only=True)
     ingredients = AddIngredientSerializer(many=True)
     tags = serializers.PrimaryKeyRelatedField(
@@ -201,34 +274,27 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
 
     def validate(self, data):
-        ingredients = data['ingredients']
-        ingredients_list = []
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            if ingredient_id in ingredients_list:
-                raise serializers.ValidationError(
-                    {'ingredients': 'Такой ингридиент уже есть.'}
-                )
-            ingredients_list.append(ingredient_id)
-            amount = ingredient['amount']
-            if not int(amount) >= 1:
-                raise serializers.ValidationError(
-                    {'amount': 'Кол-во ингредиента должно быть не менее 1.'}
-                )
-
-        if not data['tags']:
+        ingredients = data.get('ingredients', ())
+        if len({item['id'] for item in ingredients}) != len(ingredients):
+            raise serializers.ValidationError(
+                {'ingredients': 'Такой ингридиент уже есть.'}
+            )
+        if any(int(item['amount']) < 1 for item in ingredients):
             raise serializers.ValidationError(
-                {'tags': 'Выберите хотя бы один тэг.'}
+                {'amount': 'Кол-во ингредиента должно быть не менее 1.'}
             )
-        tag_list = []
-        for tag in data['tags']:
-            if tag in tag_list:
+
+        if 'tags' in data:
+            if not data['tags']:
+                raise serializers.ValidationError(
+                    {'tags': 'Выберите хотя бы один тэг.'}
+                )
+            if len(set(data['tags'])) != len(data['tags']):
                 raise serializers.ValidationError(
                     {'tags': 'Тэги должны быть уникальными.'}
                 )
-            tag_list.append(tag)
 
-        cook_time = data['cooking_time']
+        cook_time = data.get('cooking_time', 1)
         if not int(cook_time) >= 1:
             raise serializers.ValidationError(
                 {'cooking_time': 'Время приготовления должно быть не меньше 1'}
@@ -246,6 +312,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ]
         recipe.amounts.bulk_create(ingredient_list)
 
+    @transaction.atomic
     def create(self, validated_data):
         image = validated_data.pop('image')
         tags = validated_data.pop('tags')
@@ -255,16 +322,69 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         self.create_ingredients(ingredients, recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(ingredients, recipe):
+        """
+        Меняет только отличающиеся количества: новые строки Amount
+        создаются, лишние удаляются, изменённые обновляются разом.
+        """
+        current = {
+            amount.ingredient_id: amount
+            for amount in Amount.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: amount.amount for pk, amount in current.items()}
+        new_amounts = {
+            ingredient['id'].pk: ingredient['amount']
+            for ingredient in ingredients
+        }
+        if new_amounts == old_amounts:
+            return
+        removed = [
+            amount.pk for pk, amount in current.items()
+            if pk not in new_amounts
+        ]
+        changed = []
+        created = []
+        for pk, value in new_amounts.items():
+            amount = current.get(pk)
+            if amount is None:
+                created.append(
+                    Amount(recipe=recipe, ingredient_id=pk, amount=value)
+                )
+            elif amount.amount != value:
+                amount.amount = value
+                changed.append(amount)
+        if removed:
+            Amount.objects.filter(pk__in=removed).delete()
+        if changed:
+            Amount.objects.bulk_update(changed, ('amount',))
+        if created:
+            Amount.objects.bulk_create(created)
+        ShoppingCartIngredient.objects.change_recipe(
+            recipe, old_amounts, new_amounts
+        )
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
+            self.update_ingredients(
+                validated_data.pop('ingredients'), instance
+            )
         if 'tags' in validated_data:
+            # set() сам добавляет и удаляет только отличающиеся теги.
             instance.tags.set(validated_data.pop('tags'))
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        # Ингредиенты ответа одним запросом, а не по запросу на каждый.
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'amounts',
+                queryset=Amount.objects.select_related('ingredient')
+            ),
+            'tags',
+        )
         request = self.context.get('request')
         context = {'request': request}
         return RecipeListSerializer(instance, context=context).data
@@ -310,3 +430,12 @@ class ShoppingCartSerializer(BaseListSerializer):
 
     def get_error_message(self):
         return 'Этот рецепт уже в списке покупок'
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного изменения списка."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+    )
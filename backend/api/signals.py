@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Amount, Ingredient, Recipe, Tag
+from recipes.signals import data_loaded
+from users.models import MyUser
+
+from .cache import UserState, bump_version
+
+# Группы закэшированных ответов, которые зависят от модели.
+CACHE_GROUPS = {
+    Tag: ('tags', 'recipes'),
+    Ingredient: ('ingredients', 'recipes'),
+    Recipe: ('recipes',),
+    Amount: ('recipes',),
+    MyUser: ('recipes',),
+}
+
+
+def invalidate(sender):
+    groups = CACHE_GROUPS[sender]
+    transaction.on_commit(lambda: bump_version(*groups))
+
+
+def invalidate_catalogue(sender, **kwargs):
+    """Сбрасывает кэш ответов при изменении каталога."""
+    if sender is MyUser and kwargs.get('update_fields') == {'last_login'}:
+        return
+    invalidate(sender)
+
+
+# Обработчики подключаются к конкретным моделям: общий обработчик
+# post_delete отключил бы быстрое удаление для всех остальных моделей.
+for model in CACHE_GROUPS:
+    post_save.connect(invalidate_catalogue, sender=model)
+    post_delete.connect(invalidate_catalogue, sender=model)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, action, **kwargs):
+    """Сбрасывает кэш рецептов при изменении их тегов."""
+    if action.startswith('post_'):
+        invalidate(Recipe)
+
+
+@receiver(data_loaded)
+def invalidate_loaded_data(sender, user_ids=(), **kwargs):
+    """Сбрасывает кэш ответов и состояния пользователей после загрузки."""
+    user_ids = list(user_ids)
+
+    def invalidate_all():
+        bump_version('ingredients', 'tags', 'recipes')
+        UserState.invalidate_many(user_ids)
+
+    transaction.on_commit(invalidate_all)
@@ -0,0 +1,370 @@
+import struct
+import zlib
+from base64 import b64decode, b64encode
+from io import BytesIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from recipes.counters import recount
+from recipes.lists import insert_into_list
+from recipes.models import (
+    Amount,
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+)
+from recipes.search import reset_search_index, update_search_vectors
+from users.models import MyUser
+
+from . import profiling
+from .async_views import async_urls
+from .cache import UserState
+from .fields import StreamingBase64ImageField
+from .representations import Representation
+from .urls import router
+
+# Маршруты API в режиме ASGI_MODE для AsyncTests.
+urlpatterns = [path('api/', include(async_urls(router.urls)))]
+
+
+class SearchPaginationTests(TestCase):
+    """Поиск рецептов постранично по курсору."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = MyUser.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        # Одинаковые рецепты: у всех одна релевантность.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name='Борщ',
+                text='Свёкла и капуста',
+                cooking_time=60,
+                image='recipe_images/test.jpg',
+            ) for _ in range(15)
+        )
+        update_search_vectors()
+        cls.recipe_ids = set(Recipe.objects.values_list('id', flat=True))
+
+    def setUp(self):
+        reset_search_index()
+
+    def test_equal_rank_longer_than_page(self):
+        response = self.client.get(
+            '/api/recipes/', {'search': 'борщ', 'limit': 4, 'cursor': ''}
+        )
+        seen = []
+        for _ in range(len(self.recipe_ids)):
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+            if url is None:
+                break
+            response = self.client.get(url)
+        self.assertIsNone(url, 'курсор не продвигается')
+        self.assertEqual(len(seen), len(set(seen)), 'строки повторяются')
+        self.assertEqual(set(seen), self.recipe_ids)
+
+
+class SearchFallbackTests(TestCase):
+    """Поиск по индексу в памяти, когда совпадений очень много."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = MyUser.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        # У каждого пятого рецепта слово ещё и в описании: ранг выше.
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name='Суп',
+                text='Наваристый суп' if number % 5 == 0 else 'Описание',
+                cooking_time=30,
+                image='recipe_images/test.jpg',
+            ) for number in range(3000)
+        )
+
+    def setUp(self):
+        reset_search_index()
+
+    def test_many_matches_limited_to_best(self):
+        best = set(Recipe.objects.filter(
+            text__contains='суп'
+        ).order_by('-id').values_list('id', flat=True)[:50])
+        with override_settings(RECIPE_SEARCH_MAX_RESULTS=50):
+            response = self.client.get(
+                '/api/recipes/', {'search': 'суп', 'limit': 50}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 50)
+        self.assertEqual(
+            {recipe['id'] for recipe in response.data['results']}, best
+        )
+
+    def test_many_matches_default_limit(self):
+        response = self.client.get('/api/recipes/', {'search': 'суп'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['count'], settings.RECIPE_SEARCH_MAX_RESULTS
+        )
+        self.assertEqual(response.data['results'][0]['id'], max(
+            Recipe.objects.filter(
+                text__contains='суп'
+            ).values_list('id', flat=True)
+        ))
+
+
+class ListBatchTests(TestCase):
+    """Пакетные изменения избранного и списка покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(
+            username='user', email='user@example.com', password='pass'
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user,
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                image='recipe_images/test.jpg',
+            ) for number in range(3)
+        )
+        cls.recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_remove_keeps_counters(self):
+        recipe_ids = self.recipe_ids
+        url = '/api/recipes/shopping_cart/'
+        self.client.post(url, {'recipes': recipe_ids}, format='json')
+        response = self.client.delete(
+            url, {'recipes': recipe_ids[:2]}, format='json'
+        )
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['removed', 'removed'],
+        )
+        self.assertEqual(
+            list(ShoppingCart.objects.values_list('recipe_id', flat=True)),
+            recipe_ids[2:],
+        )
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'shopping_count', flat=True
+            )),
+            [0, 0, 1],
+        )
+        mismatches = recount(fix=False)
+        self.assertEqual(mismatches[Recipe, 'favorites_count'], 0)
+        self.assertEqual(mismatches[Recipe, 'shopping_count'], 0)
+
+    def test_add_counts_only_inserted_rows(self):
+        recipe_ids = self.recipe_ids
+        url = '/api/recipes/favorite/'
+        self.client.post(url, {'recipes': recipe_ids[:2]}, format='json')
+        response = self.client.post(
+            url, {'recipes': recipe_ids}, format='json'
+        )
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['already_added', 'already_added', 'added'],
+        )
+        # Запись, которую успел вставить параллельный запрос.
+        self.assertEqual(
+            insert_into_list(Favorite, self.user.id, recipe_ids), set()
+        )
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )),
+            [1, 1, 1],
+        )
+
+    def test_download_etag(self):
+        ingredient = Ingredient.objects.create(
+            name='Свёкла', measurement_unit='г'
+        )
+        Amount.objects.create(
+            recipe_id=self.recipe_ids[0], ingredient=ingredient, amount=100
+        )
+        self.client.post(
+            f'/api/recipes/{self.recipe_ids[0]}/shopping_cart/'
+        )
+        url = '/api/recipes/download_shopping_cart/?format=txt'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class ProfilingTests(TestCase):
+    """Замеры ProfilingMiddleware."""
+
+    def test_representation_counts_as_serializer(self):
+        class ItemRepresentation(Representation):
+            represent = staticmethod(lambda item, state: {'id': item})
+
+        profile = profiling.RequestProfile()
+        token = profiling._current.set(profile)
+        try:
+            data = ItemRepresentation(
+                range(1000), many=True, context={'user_state': UserState.EMPTY}
+            ).data
+        finally:
+            profiling._current.reset(token)
+        self.assertEqual(len(data), 1000)
+        self.assertGreater(profile.serializer_time, 0)
+        self.assertFalse(profile.in_serializer)
+
+
+@override_settings(ROOT_URLCONF='api.tests', PROFILING_ENABLED=True)
+class AsyncTests(TransactionTestCase):
+    """Асинхронные представления api.async_views под ASGI."""
+
+    def setUp(self):
+        profiling.store.reset()
+
+    async def test_queries_counted_in_thread_pool(self):
+        labels = {'method': 'GET', 'route': 'recipes-list'}
+        before = REGISTRY.get_sample_value(
+            'foodgram_http_request_db_queries_sum', labels
+        ) or 0
+        response = await self.async_client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(REGISTRY.get_sample_value(
+            'foodgram_http_request_db_queries_sum', labels
+        ), before)
+        self.assertNotIn(' 0 queries', response['Server-Timing'])
+        self.assertEqual(
+            list(profiling.store.endpoints), ['RecipeViewSet.list']
+        )
+
+
+class MetricsTests(TestCase):
+    """Доступ к /api/metrics."""
+
+    def test_closed_without_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 401)
+        self.assertEqual(self.client.get(
+            '/api/metrics', HTTP_AUTHORIZATION='Bearer wrong'
+        ).status_code, 401)
+        response = self.client.get(
+            '/api/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'foodgram_http_requests_total', response.content)
+
+
+class ImageFieldTests(TestCase):
+    """Загрузка картинки в base64 по кускам."""
+
+    def decode(self, content):
+        field = StreamingBase64ImageField()
+        with patch('api.fields.b64decode', wraps=b64decode) as decode:
+            try:
+                return field.to_internal_value(
+                    'data:image/png;base64,' + b64encode(content).decode()
+                ), decode.call_count
+            except ValidationError as error:
+                return error.get_codes(), decode.call_count
+
+    @staticmethod
+    def png_header(width, height):
+        ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+        return (
+            b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR'
+            + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+        )
+
+    def test_not_image_rejected_after_first_chunk(self):
+        codes, chunks = self.decode(b'\0' * 5 * 1024 * 1024)
+        self.assertEqual(codes, ['invalid_format'])
+        self.assertEqual(chunks, 1)
+
+    def test_too_many_pixels_rejected_after_first_chunk(self):
+        data = b'\0' * 5 * 1024 * 1024
+        codes, chunks = self.decode(
+            self.png_header(100_000, 100_000)
+            + struct.pack('>I', len(data)) + b'IDAT' + data
+        )
+        self.assertEqual(codes, ['too_many_pixels'])
+        self.assertEqual(chunks, 1)
+
+    def test_valid_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, 'PNG')
+        file, chunks = self.decode(buffer.getvalue())
+        self.assertTrue(file.name.endswith('.png'))
+        self.assertEqual(chunks, 1)
+
+
+class AdminCartTotalsTests(TestCase):
+    """Итоги списков покупок после правок состава рецепта в админке."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = MyUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.admin,
+            name='Борщ',
+            text='Описание',
+            cooking_time=60,
+            image='recipe_images/test.jpg',
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Свёкла', measurement_unit='г'
+        )
+        cls.amount = Amount.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=100
+        )
+        ShoppingCart.objects.create(user=cls.admin, recipe=cls.recipe)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get_total(self):
+        return self.admin.cart_ingredients.get(
+            ingredient=self.ingredient
+        ).amount
+
+    def test_change_and_delete_amount(self):
+        self.assertEqual(self.get_total(), 100)
+        url = f'/admin/recipes/amount/{self.amount.pk}/'
+        response = self.client.post(f'{url}change/', {
+            'recipe': self.recipe.pk,
+            'ingredient': self.ingredient.pk,
+            'amount': 250,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.get_total(), 250)
+        response = self.client.post(f'{url}delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.admin.cart_ingredients.filter(
+            amount__gt=0
+        ).exists())
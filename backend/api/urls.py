@@ -1,7 +1,16 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, MyUserViewSet, RecipeViewSet, TagViewSet
+from .async_views import async_urls
+from .views import (
+    IngredientViewSet,
+    MyUserViewSet,
+    ProfilingView,
+    RecipeViewSet,
+    TagViewSet,
+    metrics,
+)
 
 router = DefaultRouter()
 router.register('users', MyUserViewSet, basename='users')
@@ -9,8 +18,14 @@ router.register('recipes', RecipeViewSet, 'recipes')
 router.register('tags', TagViewSet, 'tags')
 router.register('ingredients', IngredientViewSet, 'ingredients')
 
+router_urls = router.urls
+if settings.ASGI_MODE:
+    router_urls = async_urls(router_urls)
+
 urlpatterns = (
-    path('', include(router.urls)),
+    path('', include(router_urls)),
+    path('profiling/', ProfilingView.as_view(), name='profiling'),
+    re_path(r'^metrics/?$', metrics, name='metrics'),
 
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,30 +1,81 @@
-from datetime import datetime
+from hashlib import md5
+from hmac import compare_digest
 
-from django.db.models import F, Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.conf import settings
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Sum,
+)
+from django.db.models.functions import Cast
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import (
     SAFE_METHODS,
+    IsAdminUser,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly,
 )
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipes.models import Amount, Ingredient, Recipe, Tag
+from recipes.ingredient_index import get_ingredient_index
+from recipes.lists import add_to_list, remove_from_list
+from recipes.models import (
+    Amount,
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
 from users.models import MyUser
 
+from .cache import (
+    CachedResponseMixin,
+    UserState,
+    get_user_state,
+    overlay_counters,
+)
 from .filters import IngredientFilter, RecipeFilter
-from .paginations import RestrictPagination
+from .metrics import render_metrics
+from .paginations import KeysetPagination, SubscriptionPagination
 from .permissions import AuthorStaffOrReadOnly
+from .profiling import store as profile_store
+from .renderers import (
+    SHOPPING_LIST_RENDERERS,
+    JSONFragment,
+    encode_json,
+)
+from .representations import (
+    CookableRecipeRepresentation,
+    RecipeListRepresentation,
+)
 from .serializers import (
+    CookableRecipeSerializer,
     FavoriteSerializer,
     FollowSerializer,
     IngredientSerializer,
     MyUserSerializer,
+    RecipeBatchSerializer,
     RecipeCreateSerializer,
     RecipeListSerializer,
     ShoppingCartSerializer,
@@ -41,11 +92,29 @@ class MyUserViewSet(UserViewSet):
 
     @action(methods=['GET'],
             detail=False,
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            pagination_class=SubscriptionPagination)
     def subscriptions(self, request):
         """Выдача подписок авторизванным пользователям"""
         user = self.request.user
-        authors = MyUser.objects.filter(followings__user=user)
+        # Подзапрос с LIMIT выполняется для каждого автора и читает
+        # индекс recipe_author_pub_date_idx. Фильтровать по Window
+        # в Django 3.2 нельзя.
+        limit = FollowSerializer.get_recipes_limit(request)
+        recent_recipes = Recipe.objects.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).order_by('-pub_date', '-id').values('pk')[:limit]
+        ))
+        authors = MyUser.objects.filter(
+            followings__user=user
+        ).prefetch_related(
+            Prefetch(
+                'recipes',
+                queryset=recent_recipes,
+                to_attr='recent_recipes'
+            )
+        ).order_by('id')
         pages = self.paginate_queryset(authors)
         serializer = FollowSerializer(
             pages,
@@ -71,6 +140,7 @@ class MyUserViewSet(UserViewSet):
                 )
             serializer = FollowSerializer(author, context={'request': request})
             user.followers.create(author=author)
+            UserState.invalidate(user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
@@ -80,19 +150,26 @@ class MyUserViewSet(UserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         subscription.delete()
+        UserState.invalidate(user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
     """Получение тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = None
+    cache_group = 'tags'
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
-    """Получение ингердиентов. Поиск по названию."""
+class IngredientViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
+    """
+    Получение ингердиентов. Поиск по названию.
+    Список и поиск обслуживаются индексом в памяти без обращения к БД,
+    если он не отключён настройкой INGREDIENT_INDEX_ENABLED.
+    Параметр limit ограничивает количество результатов.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
@@ -100,22 +177,93 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
     search_fields = ('^name',)
     pagination_class = None
+    cache_group = 'ingredients'
 
+    @staticmethod
+    def get_limit(query_params):
+        try:
+            limit = int(query_params['limit'])
+        except (KeyError, ValueError):
+            return None
+        return max(limit, 0)
 
-class RecipeViewSet(ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        limit = self.get_limit(request.query_params)
+        if settings.INGREDIENT_INDEX_ENABLED:
+            return Response(get_ingredient_index().search(
+                request.query_params.get('name', ''), limit
+            ))
+        return self.get_cached_response(request, lambda: Response(
+            self.get_serializer(
+                self.filter_queryset(self.get_queryset())[:limit], many=True
+            ).data
+        ))
+
+
+class RecipeViewSet(CachedResponseMixin, ModelViewSet):
     """
     Операции с рецептами.
     Фильтрация по автору, тегу, подписке и наличию в списке покупок.
+    Рецепт отдаётся из общего кэша с признаками текущего пользователя
+    и текущими счётчиками.
     """
     queryset = Recipe.objects.all()
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     permission_classes = [AuthorStaffOrReadOnly]
-    pagination_class = RestrictPagination
+    pagination_class = KeysetPagination
     http_method_names = ['get', 'post', 'patch', 'delete']
+    cache_group = 'recipes'
+    cache_actions = ('retrieve',)
+
+    def get_queryset(self):
+        """
+        Рецепты вместе с автором, тегами и ингредиентами.
+        Признаки избранного, списка покупок и подписки на автора
+        берутся из UserState, без запросов на каждый рецепт.
+        """
+        return Recipe.objects.select_related('author').prefetch_related(
+            Prefetch(
+                'amounts',
+                queryset=Amount.objects.select_related('ingredient')
+            ),
+            'tags',
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'retrieve':
+            # Рецепт кэшируется общим для всех, признаки подставляет
+            # retrieve().
+            context['user_state'] = UserState.EMPTY
+        return context
+
+    def encode_for_cache(self, data):
+        """
+        Признаки пользователя подставляются в рецепт после кэша, поэтому
+        готовым JSON хранятся только теги и ингредиенты.
+        """
+        return {
+            **data,
+            'tags': JSONFragment(encode_json(data['tags'])),
+            'ingredients': JSONFragment(encode_json(data['ingredients'])),
+        }
+
+    def from_cache(self, data):
+        return overlay_counters(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response.data = get_user_state(request).overlay_recipe(
+                response.data
+            )
+        return response
 
     def get_serializer_class(self):
-        if self.action in SAFE_METHODS:
+        if self.request.method in SAFE_METHODS:
+            if settings.FAST_READ_SERIALIZERS:
+                return RecipeListRepresentation
             return RecipeListSerializer
         return RecipeCreateSerializer
 
@@ -136,6 +284,7 @@ class RecipeViewSet(ModelViewSet):
             )
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            UserState.invalidate(user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if self.request.method == 'DELETE':
@@ -145,6 +294,7 @@ class RecipeViewSet(ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         queryset.delete()
+        UserState.invalidate(user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['POST', 'DELETE'],
@@ -159,36 +309,175 @@ class RecipeViewSet(ModelViewSet):
     def shopping_cart(self, request, pk=None):
         return self.action_post_delete(pk, ShoppingCartSerializer)
 
+    def action_batch(self, model):
+        """
+        Пакетное добавление (POST) или удаление (DELETE) рецептов
+        {"recipes": [id, ...]} одним запросом на запись.
+        В ответе итог для каждого id в порядке запроса.
+        """
+        serializer = RecipeBatchSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        user = self.request.user
+        if self.request.method == 'POST':
+            results = add_to_list(model, user.id, recipe_ids)
+        else:
+            results = remove_from_list(model, user.id, recipe_ids)
+        UserState.invalidate(user.id)
+        return Response({'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]})
+
+    @action(methods=['POST', 'DELETE'],
+            detail=False,
+            url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return self.action_batch(Favorite)
+
+    @action(methods=['POST', 'DELETE'],
+            detail=False,
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return self.action_batch(ShoppingCart)
+
+    @action(methods=['GET'], detail=False)
+    def can_cook(self, request):
+        """
+        Рецепты из имеющихся ингредиентов: ?ingredients=1,2&ingredients=3.
+        Порядок — по доле ингредиентов рецепта, которые есть в наличии,
+        затем по их числу. Считается одним сгруппированным запросом
+        по Amount только для рецептов хотя бы с одним из ингредиентов.
+        Остальные фильтры ленты (теги, автор и т.д.) тоже применяются.
+        """
+        try:
+            ingredient_ids = {
+                int(pk)
+                for value in request.query_params.getlist('ingredients')
+                for pk in value.split(',') if pk.strip()
+            }
+        except ValueError:
+            ingredient_ids = None
+        if not ingredient_ids:
+            return Response(
+                {'ingredients': 'Укажите id ингредиентов.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            pk__in=Amount.objects.filter(
+                ingredient_id__in=ingredient_ids
+            ).values('recipe_id')
+        ).annotate(
+            ingredients_total=Count('amounts'),
+            ingredients_matched=Count(
+                'amounts',
+                filter=Q(amounts__ingredient_id__in=ingredient_ids)
+            ),
+        ).annotate(
+            coverage=ExpressionWrapper(
+                Cast('ingredients_matched', FloatField())
+                / F('ingredients_total'),
+                output_field=FloatField()
+            )
+        ).order_by('-coverage', '-ingredients_matched', '-id')
+        page = self.paginate_queryset(queryset)
+        serializer_class = CookableRecipeSerializer
+        if settings.FAST_READ_SERIALIZERS:
+            serializer_class = CookableRecipeRepresentation
+        serializer = serializer_class(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
     @action(methods=['GET'],
             detail=False,
             permission_classes=[IsAuthenticated],
-            pagination_class=None)
+            pagination_class=None,
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
-        """Добавление рецептов в список покупок."""
+        """
+        Выгрузка списка покупок в формате txt, csv или json.
+        Формат выбирается параметром format или заголовком Accept.
+        Итоги берутся из ShoppingCartIngredient и отдаются потоком,
+        повторная загрузка неизменённого списка получает ответ 304.
+        """
         user = request.user
-        if not user.shopcarts.exists():
+        ingredient_list = user.cart_ingredients.filter(amount__gt=0)
+        state = user.cart_ingredients.aggregate(
+            ingredients=Count('id', filter=Q(amount__gt=0)),
+            total=Sum('amount'),
+            updated=Max('updated'),
+        )
+        if not state['ingredients']:
             return Response({'error': 'В списке покупок пусто'},
                             status=status.HTTP_204_NO_CONTENT)
-        ingredient_list = Amount.objects.filter(
-            recipe__shopcarts__user=user
-        ).values(
-            ingredients=F('ingredient__name'),
-            measure_units=F('ingredient__measurement_unit')
-        ).annotate(amount=Sum('amount'))
-
-        filename = f'{user.username}_shopping_card.txt'
-        shopping_list = (
-            f'Список покупок\n\n'
-            f'Загрузил пользователь:{user.username}\n'
-            f'Создан: {datetime.now().strftime("%d/%m/%Y %H:%M")}\n\n'
+        renderer = request.accepted_renderer
+        # ETag считается по итогам списка, а не по байтам ответа (в txt
+        # есть время выгрузки), поэтому он слабый.
+        etag = 'W/' + quote_etag(md5(
+            f'{renderer.format}:{sorted(state.items())}'.encode()
+        ).hexdigest())
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(state['updated'].timestamp())
+        )
+        if response is not None:
+            return response
+
+        ingredient_list = ingredient_list.values(
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit')
+        ).order_by('name')
+
+        filename = f'{user.username}_shopping_card.{renderer.format}'
+        response = StreamingHttpResponse(
+            renderer.stream(user, ingredient_list.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
         )
-        for ing in ingredient_list:
-            shopping_list += (
-                f'{ing["ingredients"]} --- '
-                f'{ing["amount"]} {ing["measure_units"]}\n'
-            )
-        shopping_list += ('\nБэкенд проекта разработал Антон Корчагин')
-        response = HttpResponse(shopping_list,
-                                content_type='text.txt; charset=utf-8')
         response['Content-Disposition'] = f'attachment; filename={filename}'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(state['updated'].timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Accept', 'Authorization'))
         return response
+
+
+class ProfilingView(APIView):
+    """
+    Сводка ProfilingMiddleware по endpoint для персонала: время ответа
+    с гистограммой, время БД и сериализации, повторяющиеся запросы.
+    Данные свои у каждого процесса; DELETE очищает их.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'enabled': settings.PROFILING_ENABLED,
+            'endpoints': profile_store.snapshot(),
+        })
+
+    def delete(self, request):
+        profile_store.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def metrics(request):
+    """
+    Метрики Prometheus по заголовку Authorization: Bearer <METRICS_TOKEN>.
+    Пока METRICS_TOKEN не задан, адрес не отдаётся никому.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    if not compare_digest(
+        request.headers.get('Authorization', '').encode(),
+        f'Bearer {token}'.encode(),
+    ):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)
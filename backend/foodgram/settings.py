@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,6 +92,43 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Redis: CACHE_URL=redis://host:6379/1 (нужен пакет django-redis).
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+CATALOGUE_CACHE_TIMEOUT = env.int('CATALOGUE_CACHE_TIMEOUT', default=60 * 60)
+USER_STATE_CACHE_TIMEOUT = env.int('USER_STATE_CACHE_TIMEOUT', default=5 * 60)
+
+# Метрики Prometheus на /api/metrics (api.metrics). Адрес отдаёт их
+# только с токеном METRICS_TOKEN; без токена метрики не открыты.
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Профилирование запросов (api.profiling), по умолчанию выключено.
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+# Доля запросов под cProfile и порог, после которого профиль сохраняется.
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', default=0.0)
+PROFILING_SLOW_MS = env.int('PROFILING_SLOW_MS', default=500)
+PROFILING_DIR = env('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+
+# Лента рецептов отдаётся функциями api.representations вместо
+# сериализаторов DRF; False возвращает сериализаторы.
+FAST_READ_SERIALIZERS = env.bool('FAST_READ_SERIALIZERS', default=True)
+
+# Наибольшее число рецептов в одном пакетном запросе к спискам.
+RECIPE_BATCH_MAX_SIZE = env.int('RECIPE_BATCH_MAX_SIZE', default=100)
+
+# Запуск под ASGI (uvicorn-воркеры, см. gunicorn.conf.py): маршруты API
+# обслуживают асинхронные представления api.async_views, блокирующая
+# работа выполняется в пуле из ASGI_THREADS потоков на процесс.
+ASGI_MODE = env.bool('ASGI_MODE', default=False)
+ASGI_THREADS = env.int('ASGI_THREADS', default=8)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -141,6 +180,32 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 RECIPE_SHOTNAME = 20
 MAX_NAME_LEN = 100
+RECIPES_LIMIT = 3
+
+# Рейтинг «в тренде» (команда rank_recipes).
+TRENDING_WINDOW_DAYS = env.int('TRENDING_WINDOW_DAYS', default=14)
+TRENDING_HALF_LIFE_HOURS = env.int('TRENDING_HALF_LIFE_HOURS', default=48)
+
+# Автодополнение ингредиентов из индекса в памяти процесса.
+INGREDIENT_INDEX_ENABLED = env.bool('INGREDIENT_INDEX_ENABLED', default=True)
+INGREDIENT_INDEX_TTL = env.int('INGREDIENT_INDEX_TTL', default=300)
+
+# Загрузка картинок рецептов в base64 (api.fields).
+IMAGE_UPLOAD_MAX_BYTES = env.int(
+    'IMAGE_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024
+)
+IMAGE_UPLOAD_MAX_PIXELS = env.int('IMAGE_UPLOAD_MAX_PIXELS', default=25_000_000)
+
+# Миниатюры картинок рецептов (recipes.thumbnails).
+THUMBNAIL_WIDTHS = (240, 480, 960)
+THUMBNAIL_ASYNC = env.bool('THUMBNAIL_ASYNC', default=True)
+THUMBNAIL_WORKERS = env.int('THUMBNAIL_WORKERS', default=2)
+
+# Поиск рецептов без PostgreSQL: индекс в памяти процесса.
+RECIPE_SEARCH_INDEX_TTL = env.int('RECIPE_SEARCH_INDEX_TTL', default=300)
+# Сколько лучших совпадений попадает в выборку. id каждого дважды входит
+# в параметры SQL, а у SQLite бывает ограничение в 999 параметров.
+RECIPE_SEARCH_MAX_RESULTS = env.int('RECIPE_SEARCH_MAX_RESULTS', default=400)
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -149,6 +214,15 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 3,
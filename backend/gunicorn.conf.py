@@ -0,0 +1,51 @@
+import os
+import shutil
+
+import environ
+
+environ.Env.read_env(os.path.join(os.path.dirname(__file__), '.env'))
+
+# ASGI_MODE: uvicorn-воркеры и асинхронные представления api.async_views.
+if environ.Env().bool('ASGI_MODE', default=False):
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+
+# Воркеры пишут метрики Prometheus в общий каталог, а /api/metrics
+# собирает их оттуда (api.metrics.render_metrics).
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+
+def check_cache(workers):
+    """
+    Закэшированные ответы сбрасываются увеличением версии в кэше
+    (api.cache). Кэш в памяти процесса у каждого воркера свой, и
+    остальные воркеры отдавали бы устаревшие ответы до истечения срока.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    from django.conf import settings
+
+    backend = settings.CACHES['default']['BACKEND']
+    if workers > 1 and backend.endswith('.LocMemCache'):
+        raise RuntimeError(
+            f'Для {workers} воркеров нужен общий кэш: задайте CACHE_URL '
+            f'(Redis или memcached) или запустите один воркер.'
+        )
+
+
+def on_starting(server):
+    """
+    Проверяет кэш и удаляет метрики прошлого запуска до старта
+    воркеров.
+    """
+    check_cache(server.cfg.workers)
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,6 +1,15 @@
 from django.contrib.admin import ModelAdmin, TabularInline, site
 
-from .models import Amount, Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from .models import (
+    Amount,
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeRank,
+    ShoppingCart,
+    ShoppingCartIngredient,
+    Tag,
+)
 
 
 class AmountInline(TabularInline):
@@ -15,14 +24,15 @@ class AmountInline(TabularInline):
 class RecipeAdmin(ModelAdmin):
     """
     Отображение модели Recipe в админ панели.
-    Выводит в карточке рецепта кол-во добавления в избранное и список покупок.
+    Выводит кол-во добавления в избранное и список покупок.
     В список рецептов добавлено поле с тегами.
     """
-    list_display = ('name', 'author', 'display_tags')
+    list_display = ('name', 'author', 'display_tags', 'favorites_count',
+                    'shopping_count')
     list_filter = ('name', 'author', 'tags')
     search_fields = ('name', 'author__username', 'author__last_name',
                      'author__first_name', 'tags__name')
-    readonly_fields = ('favorite_count', 'shopping_count')
+    readonly_fields = ('favorites_count', 'shopping_count')
     filter_vertical = ('tags', 'ingredients')
     inlines = (AmountInline,)
     empty_value_display = '-нет-'
@@ -30,15 +40,16 @@ class RecipeAdmin(ModelAdmin):
     def display_tags(self, obj):
         return ', '.join([tag.name for tag in obj.tags.all()])
 
-    def favorite_count(self, obj):
-        return obj.favorites.count()
-
-    def shopping_count(self, obj):
-        return obj.shopcarts.count()
-
     display_tags.short_description = 'Теги'
-    favorite_count.short_description = 'В избранном'
-    shopping_count.short_description = 'В списке покупок'
+
+    def save_related(self, request, form, formsets, change):
+        """Итоги списков покупок учитывают изменённый состав рецепта."""
+        super().save_related(request, form, formsets, change)
+        if change and (
+            'ingredients' in form.changed_data
+            or any(formset.has_changed() for formset in formsets)
+        ):
+            ShoppingCartIngredient.objects.rebuild_recipes([form.instance.pk])
 
 
 class IngredientAdmin(ModelAdmin):
@@ -49,9 +60,42 @@ class IngredientAdmin(ModelAdmin):
 
 
 class AmountAdmin(ModelAdmin):
-    """Кастомное отображение модели Amount."""
+    """
+    Кастомное отображение модели Amount.
+    После изменений пересчитываются итоги списков покупок с рецептом.
+    """
     list_display = ('recipe', 'ingredient', 'amount')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        recipe_ids = {obj.recipe_id}
+        if change and 'recipe' in form.changed_data:
+            recipe_ids.add(form.initial['recipe'])
+        ShoppingCartIngredient.objects.rebuild_recipes(recipe_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingCartIngredient.objects.rebuild_recipes([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingCartIngredient.objects.rebuild_recipes(recipe_ids)
+
+
+class ShoppingCartIngredientAdmin(ModelAdmin):
+    """Итоги списков покупок, только просмотр."""
+    list_display = ('user', 'ingredient', 'amount', 'updated')
+    search_fields = ('user__username', 'ingredient__name')
+    readonly_fields = ('user', 'ingredient', 'amount', 'updated')
+
+
+class RecipeRankAdmin(ModelAdmin):
+    """Рейтинг рецептов, только просмотр."""
+    list_display = ('recipe', 'trending', 'updated')
+    search_fields = ('recipe__name',)
+    readonly_fields = ('recipe', 'trending', 'updated')
+
 
 site.register(Recipe, RecipeAdmin)
 site.register(Ingredient, IngredientAdmin)
@@ -59,3 +103,5 @@ site.register(Amount, AmountAdmin)
 site.register(Tag)
 site.register(Favorite)
 site.register(ShoppingCart)
+site.register(ShoppingCartIngredient, ShoppingCartIngredientAdmin)
+site.register(RecipeRank, RecipeRankAdmin)
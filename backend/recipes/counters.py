@@ -0,0 +1,51 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow, MyUser
+
+from .models import Favorite, Recipe, ShoppingCart
+
+# Счётчики: (модель, поле счётчика, модель записей, внешний ключ записи).
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_count', ShoppingCart, 'recipe'),
+    (MyUser, 'recipes_count', Recipe, 'author'),
+    (MyUser, 'followers_count', Follow, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик через F(), не опуская его ниже нуля."""
+    change_counters(model, [pk], field, delta)
+
+
+def change_counters(model, pks, field, delta):
+    """То же для нескольких записей одним UPDATE."""
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def recount(fix=True):
+    """
+    Сравнивает счётчики с фактическим числом записей и, если fix,
+    исправляет расхождения.
+    Возвращает число расхождений по каждому счётчику: {(модель, поле): n}.
+    """
+    mismatches = {}
+    for model, field, source, foreign_key in COUNTERS:
+        actual = Subquery(
+            source.objects.filter(**{foreign_key: OuterRef('pk')}).order_by(
+            ).values(foreign_key).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField(),
+        )
+        wrong = model.objects.annotate(
+            actual=Coalesce(actual, 0)
+        ).exclude(**{field: F('actual')})
+        mismatches[model, field] = wrong.count()
+        if fix and mismatches[model, field]:
+            model.objects.filter(
+                pk__in=wrong.values('pk')
+            ).update(**{field: Coalesce(actual, 0)})
+    return mismatches
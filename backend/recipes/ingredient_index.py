@@ -0,0 +1,105 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .models import Ingredient
+
+WORD_START = re.compile(r'(?<=[\s\-(,])\w')
+# Символ больше любой буквы: граница диапазона строк с заданным префиксом.
+PREFIX_END = '\U0010ffff'
+
+
+class IngredientIndex:
+    """
+    Неизменяемый индекс ингредиентов для автодополнения.
+    Названия хранятся отсортированными в нижнем регистре, поэтому точное
+    совпадение и поиск по началу названия или слова сводятся к бинарному
+    поиску; поиск по подстроке проходит по всем названиям.
+    Порядок выдачи: точное совпадение, начало названия, начало слова,
+    подстрока; внутри группы — по названию.
+    """
+
+    def __init__(self, ingredients):
+        rows = sorted(ingredients, key=lambda row: (row[1].lower(), row[0]))
+        self.items = tuple(
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for pk, name, measurement_unit in rows
+        )
+        self.names = tuple(name.lower() for _, name, _ in rows)
+        self.words = tuple(sorted(
+            (name[match.start():], position)
+            for position, name in enumerate(self.names)
+            for match in WORD_START.finditer(name)
+        ))
+        self.built = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        return cls(Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ))
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, query, limit=None):
+        """Ингредиенты, название которых содержит query."""
+        query = query.strip().lower()
+        if limit is None:
+            limit = len(self.items)
+        if not query:
+            return list(self.items[:limit])
+
+        start = bisect_left(self.names, query)
+        end = bisect_left(self.names, query + PREFIX_END, start)
+        # Точные совпадения стоят первыми в диапазоне префикса.
+        found = list(range(start, end))
+        if len(found) < limit:
+            seen = set(found)
+            word_start = bisect_left(self.words, (query,))
+            word_end = bisect_left(self.words, (query + PREFIX_END,))
+            found.extend(sorted(
+                {position for _, position in self.words[word_start:word_end]}
+                - seen
+            ))
+        if len(found) < limit:
+            seen = set(found)
+            found.extend(
+                position for position, name in enumerate(self.names)
+                if query in name and position not in seen
+            )
+        return [self.items[position] for position in found[:limit]]
+
+
+_state = {'index': None}
+_lock = threading.Lock()
+
+
+def get_ingredient_index(build=True):
+    """
+    Индекс текущего процесса.
+    Строится при первом обращении и перестраивается после изменения
+    ингредиентов в этом процессе или по истечении
+    INGREDIENT_INDEX_TTL секунд (изменения из других процессов).
+    С build=False вместо построения возвращает None: так индекс можно
+    взять без обращения к БД.
+    """
+    index = _state['index']
+    if (
+        index is None
+        or time.monotonic() - index.built > settings.INGREDIENT_INDEX_TTL
+    ):
+        if not build:
+            return None
+        with _lock:
+            if _state['index'] is index:
+                _state['index'] = IngredientIndex.build()
+        return _state['index']
+    return index
+
+
+def reset_ingredient_index():
+    _state['index'] = None
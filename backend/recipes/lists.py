@@ -0,0 +1,134 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .counters import COUNTERS, change_counters
+from .models import Recipe, ShoppingCart, ShoppingCartIngredient
+
+User = get_user_model()
+
+# Итог для каждого id рецепта.
+ADDED = 'added'
+ALREADY_ADDED = 'already_added'
+REMOVED = 'removed'
+NOT_ADDED = 'not_added'
+NOT_FOUND = 'not_found'
+
+
+def lock_user(user_id):
+    """
+    Блокирует строку пользователя: пакетные изменения его списков
+    выполняются по очереди и видят состояние друг друга.
+    """
+    list(User.objects.select_for_update().filter(
+        pk=user_id
+    ).values_list('pk', flat=True))
+
+
+def update_list_totals(model, user_id, recipe_ids, sign):
+    """
+    Счётчики и итоги списка покупок, которые для одной записи
+    поддерживают сигналы: insert_into_list и delete_from_list их не
+    отправляют. Других ручных изменений счётчиков у списков нет.
+    """
+    for counted_model, field, source, foreign_key in COUNTERS:
+        if source is model:
+            change_counters(counted_model, recipe_ids, field, sign)
+    if model is ShoppingCart:
+        ShoppingCartIngredient.objects.add_recipes(user_id, recipe_ids, sign)
+
+
+def execute_returning(sql, params):
+    """id рецептов из RETURNING запроса."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def insert_into_list(model, user_id, recipe_ids):
+    """
+    Добавляет записи списка одним INSERT без сигнала post_save.
+    Уже существующие записи пропускает ON CONFLICT DO NOTHING, а
+    RETURNING возвращает id рецептов, записи которых действительно
+    вставлены: счётчики меняются только для них, даже если записи
+    добавил параллельный запрос.
+    """
+    if not recipe_ids:
+        return set()
+    quote = connection.ops.quote_name
+    opts = model._meta
+    recipe_column = quote(opts.get_field('recipe').column)
+    columns = ', '.join(
+        quote(opts.get_field(name).column)
+        for name in ('user', 'recipe', 'created')
+    )
+    created = connection.ops.adapt_datetimefield_value(timezone.now())
+    return execute_returning(
+        f'INSERT INTO {quote(opts.db_table)} ({columns}) '
+        f'VALUES {", ".join(["(%s, %s, %s)"] * len(recipe_ids))} '
+        f'ON CONFLICT DO NOTHING RETURNING {recipe_column}',
+        [
+            value for pk in recipe_ids
+            for value in (user_id, pk, created)
+        ],
+    )
+
+
+def delete_from_list(model, user_id, recipe_ids):
+    """
+    Удаляет записи списка одним DELETE без сигналов pre_delete и
+    post_delete. QuerySet.delete() при подключённых обработчиках
+    загрузил бы записи и отправил сигналы для каждой, меняя счётчики
+    и итоги по одной записи; их работу за один запрос делает
+    update_list_totals. Записи списков ни на что не ссылаются, каскада
+    нет, поэтому простой DELETE ничего не пропускает.
+    Возвращает id рецептов, записи которых действительно удалены.
+    """
+    if not recipe_ids:
+        return set()
+    quote = connection.ops.quote_name
+    opts = model._meta
+    recipe_column = quote(opts.get_field('recipe').column)
+    return execute_returning(
+        f'DELETE FROM {quote(opts.db_table)} '
+        f'WHERE {quote(opts.get_field("user").column)} = %s '
+        f'AND {recipe_column} '
+        f'IN ({", ".join(["%s"] * len(recipe_ids))}) '
+        f'RETURNING {recipe_column}',
+        [user_id, *recipe_ids],
+    )
+
+
+def add_to_list(model, user_id, recipe_ids):
+    """
+    Добавляет рецепты в избранное или список покупок (model) одним
+    INSERT. Возвращает {id рецепта: итог}.
+    """
+    with transaction.atomic():
+        lock_user(user_id)
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        added = insert_into_list(model, user_id, found)
+        update_list_totals(model, user_id, added, 1)
+    return {
+        pk: ADDED if pk in added
+        else ALREADY_ADDED if pk in found else NOT_FOUND
+        for pk in recipe_ids
+    }
+
+
+def remove_from_list(model, user_id, recipe_ids):
+    """Удаляет рецепты из списка одним DELETE. Возвращает итоги."""
+    with transaction.atomic():
+        lock_user(user_id)
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        removed = delete_from_list(model, user_id, found)
+        update_list_totals(model, user_id, removed, -1)
+    return {
+        pk: REMOVED if pk in removed
+        else NOT_ADDED if pk in found else NOT_FOUND
+        for pk in recipe_ids
+    }
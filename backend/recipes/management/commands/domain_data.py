@@ -0,0 +1,358 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from recipes.counters import recount
+from recipes.ingredient_index import reset_ingredient_index
+from recipes.models import (
+    Amount,
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeRank,
+    ShoppingCart,
+    ShoppingCartIngredient,
+    Tag,
+)
+from recipes.search import reset_search_index, update_search_vectors
+from recipes.signals import data_loaded
+from users.models import Follow, MyUser
+
+USER_FIELDS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'password',
+    'is_staff', 'is_superuser', 'is_active', 'date_joined', 'last_login',
+)
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+RECIPE_FIELDS = (
+    'id', 'author_id', 'name', 'text', 'cooking_time', 'image', 'pub_date',
+)
+# Порядок записей в файле: каждая запись ссылается только на предыдущие.
+RECORD_TYPES = (
+    'user', 'follow', 'tag', 'ingredient', 'recipe', 'favorite', 'cart',
+)
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка и загрузка данных проекта в формате NDJSON.
+    Каждая строка файла — одна запись: пользователь, подписка, тег,
+    ингредиент, рецепт с ингредиентами и тегами, избранное или список
+    покупок. При загрузке внешние ключи сопоставляются в памяти:
+    пользователи по email, теги по слагу, ингредиенты по названию и
+    единице измерения, а запись идёт пачками через bulk_create.
+    Рецепты всегда добавляются как новые.
+    """
+    help = 'Выгрузка (export) и загрузка (import) данных в формате NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('export', 'import'))
+        parser.add_argument(
+            '--path', default='-',
+            help='Файл NDJSON; по умолчанию stdout/stdin.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Количество записей в одной пачке.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.batch_size = options['batch_size']
+        path = options['path']
+        if options['action'] == 'export':
+            file = (
+                sys.stdout if path == '-'
+                else open(path, 'w', encoding='utf-8')
+            )
+            try:
+                count = self.export(file)
+            finally:
+                if file is not sys.stdout:
+                    file.close()
+        else:
+            try:
+                file = (
+                    sys.stdin if path == '-'
+                    else open(path, 'r', encoding='utf-8')
+                )
+            except FileNotFoundError:
+                raise CommandError(f'Нет файла {path}')
+            try:
+                count = self.load(file)
+            finally:
+                if file is not sys.stdin:
+                    file.close()
+        self.stderr.write(
+            f'Записей: {count}, '
+            f'время: {time.perf_counter() - started:.1f} с.'
+        )
+
+    def write(self, file, record_type, record):
+        file.write(json.dumps({'type': record_type, **record},
+                              cls=DjangoJSONEncoder, ensure_ascii=False))
+        file.write('\n')
+
+    def export(self, file):
+        count = 0
+        simple = (
+            ('user', MyUser.objects.values(*USER_FIELDS)),
+            ('follow', Follow.objects.values('user_id', 'author_id')),
+            ('tag', Tag.objects.values(*TAG_FIELDS)),
+            ('ingredient', Ingredient.objects.values(*INGREDIENT_FIELDS)),
+        )
+        for record_type, queryset in simple:
+            for record in queryset.order_by('id').iterator(self.batch_size):
+                self.write(file, record_type, record)
+                count += 1
+        for record in self.export_recipes():
+            self.write(file, 'recipe', record)
+            count += 1
+        for record_type, model in (
+            ('favorite', Favorite), ('cart', ShoppingCart)
+        ):
+            queryset = model.objects.values('user_id', 'recipe_id', 'created')
+            for record in queryset.order_by('id').iterator(self.batch_size):
+                self.write(file, record_type, record)
+                count += 1
+        return count
+
+    def export_recipes(self):
+        """Рецепты пачками по id вместе с ингредиентами и тегами."""
+        last_id = 0
+        recipe_tag = Recipe.tags.through
+        while True:
+            recipes = list(Recipe.objects.filter(id__gt=last_id).order_by(
+                'id'
+            ).values(*RECIPE_FIELDS)[:self.batch_size])
+            if not recipes:
+                return
+            ids = [recipe['id'] for recipe in recipes]
+            for recipe in recipes:
+                recipe['ingredients'] = []
+                recipe['tags'] = []
+            by_id = {recipe['id']: recipe for recipe in recipes}
+            for recipe_id, ingredient_id, amount in Amount.objects.filter(
+                recipe_id__in=ids
+            ).order_by('id').values_list('recipe_id', 'ingredient_id',
+                                         'amount'):
+                by_id[recipe_id]['ingredients'].append(
+                    [ingredient_id, amount]
+                )
+            for recipe_id, tag_id in recipe_tag.objects.filter(
+                recipe_id__in=ids
+            ).order_by('id').values_list('recipe_id', 'tag_id'):
+                by_id[recipe_id]['tags'].append(tag_id)
+            yield from recipes
+            last_id = ids[-1]
+
+    def load(self, file):
+        self.users = dict(MyUser.objects.values_list('email', 'id'))
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        }
+        # Соответствие id из файла и id в базе.
+        self.ids = {record_type: {} for record_type in RECORD_TYPES}
+        self.next_ids = {
+            model: (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+            for model in (MyUser, Tag, Ingredient, Recipe)
+        }
+        self.cart_users = set()
+        # Пользователи, у которых изменились избранное, покупки или подписки.
+        self.list_users = set()
+        count = 0
+        batch = []
+        batch_type = None
+        with transaction.atomic():
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    record_type = record.pop('type')
+                except (ValueError, KeyError):
+                    raise CommandError(f'Строка {number}: неверная запись')
+                if record_type not in RECORD_TYPES:
+                    raise CommandError(
+                        f'Строка {number}: неизвестный тип {record_type}'
+                    )
+                if batch and (
+                    record_type != batch_type
+                    or len(batch) >= self.batch_size
+                ):
+                    self.flush(batch_type, batch)
+                    batch = []
+                batch_type = record_type
+                batch.append(record)
+                count += 1
+            if batch:
+                self.flush(batch_type, batch)
+            self.reset_sequences()
+            if self.cart_users:
+                ShoppingCartIngredient.objects.rebuild(self.cart_users)
+            # bulk_create не вызывает сигналы, счётчики и рейтинг
+            # пересчитываются.
+            recount()
+            RecipeRank.objects.rebuild()
+            data_loaded.send(sender=self.__class__, user_ids=self.list_users)
+        reset_ingredient_index()
+        reset_search_index()
+        return count
+
+    def allocate_id(self, model):
+        self.next_ids[model] += 1
+        return self.next_ids[model] - 1
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [MyUser, Tag, Ingredient, Recipe]
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def flush(self, record_type, records):
+        try:
+            getattr(self, f'load_{record_type}')(records)
+        except KeyError as error:
+            raise CommandError(
+                f'Запись {record_type} ссылается на отсутствующий '
+                f'объект {error}'
+            )
+
+    def load_user(self, records):
+        users = []
+        for record in records:
+            old_id = record.pop('id')
+            pk = self.users.get(record['email'])
+            if pk is None:
+                pk = self.allocate_id(MyUser)
+                self.users[record['email']] = pk
+                for field in ('date_joined', 'last_login'):
+                    if record[field]:
+                        record[field] = parse_datetime(record[field])
+                users.append(MyUser(id=pk, **record))
+            self.ids['user'][old_id] = pk
+        MyUser.objects.bulk_create(users)
+
+    def load_follow(self, records):
+        users = self.ids['user']
+        self.list_users.update(users[record['user_id']] for record in records)
+        Follow.objects.bulk_create(
+            (
+                Follow(
+                    user_id=users[record['user_id']],
+                    author_id=users[record['author_id']],
+                ) for record in records
+            ),
+            ignore_conflicts=True
+        )
+
+    def load_tag(self, records):
+        tags = []
+        for record in records:
+            old_id = record.pop('id')
+            pk = self.tags.get(record['slug'])
+            if pk is None:
+                pk = self.allocate_id(Tag)
+                self.tags[record['slug']] = pk
+                tags.append(Tag(id=pk, **record))
+            self.ids['tag'][old_id] = pk
+        Tag.objects.bulk_create(tags)
+
+    def load_ingredient(self, records):
+        ingredients = []
+        for record in records:
+            key = (record['name'], record['measurement_unit'])
+            pk = self.ingredients.get(key)
+            if pk is None:
+                pk = self.allocate_id(Ingredient)
+                self.ingredients[key] = pk
+                ingredients.append(Ingredient(
+                    id=pk,
+                    name=record['name'],
+                    measurement_unit=record['measurement_unit'],
+                ))
+            self.ids['ingredient'][record['id']] = pk
+        Ingredient.objects.bulk_create(ingredients)
+
+    def load_recipe(self, records):
+        users = self.ids['user']
+        tags = self.ids['tag']
+        ingredients = self.ids['ingredient']
+        recipe_tag = Recipe.tags.through
+        recipes, pub_dates, amounts, recipe_tags = [], [], [], []
+        for record in records:
+            pk = self.allocate_id(Recipe)
+            self.ids['recipe'][record['id']] = pk
+            for ingredient_id, amount in record['ingredients']:
+                amounts.append(Amount(
+                    recipe_id=pk,
+                    ingredient_id=ingredients[ingredient_id],
+                    amount=amount,
+                ))
+            recipe_tags.extend(
+                recipe_tag(recipe_id=pk, tag_id=tags[tag_id])
+                for tag_id in record['tags']
+            )
+            recipes.append(Recipe(
+                id=pk,
+                author_id=users[record['author_id']],
+                name=record['name'],
+                text=record['text'],
+                cooking_time=record['cooking_time'],
+                image=record['image'],
+            ))
+            pub_dates.append(parse_datetime(record['pub_date']))
+        Recipe.objects.bulk_create(recipes)
+        # auto_now_add ставит текущую дату при вставке, возвращаем исходную.
+        for recipe, pub_date in zip(recipes, pub_dates):
+            recipe.pub_date = pub_date
+        Recipe.objects.bulk_update(recipes, ('pub_date',))
+        update_search_vectors(
+            Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes])
+        )
+        Amount.objects.bulk_create(amounts)
+        recipe_tag.objects.bulk_create(recipe_tags)
+
+    def load_user_recipes(self, model, records):
+        users = self.ids['user']
+        recipes = self.ids['recipe']
+        self.list_users.update(users[record['user_id']] for record in records)
+        # Дата добавления нужна рейтингу ordering=trending; в файлах
+        # старых выгрузок её нет.
+        now = timezone.now()
+        model.objects.bulk_create(
+            (
+                model(
+                    user_id=users[record['user_id']],
+                    recipe_id=recipes[record['recipe_id']],
+                    created=(
+                        parse_datetime(record['created'])
+                        if record.get('created') else now
+                    ),
+                ) for record in records
+            ),
+            ignore_conflicts=True
+        )
+
+    def load_favorite(self, records):
+        self.load_user_recipes(Favorite, records)
+
+    def load_cart(self, records):
+        self.load_user_recipes(ShoppingCart, records)
+        self.cart_users.update(
+            self.ids['user'][record['user_id']] for record in records
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    """Создание миниатюр для рецептов, у которых их ещё нет."""
+    help = 'Создание миниатюр картинок рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать миниатюры всех рецептов.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(thumbnails=[])
+        created = 0
+        for pk, name in recipes.values_list('pk', 'image').iterator():
+            if generate_thumbnails(pk, name):
+                created += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры созданы для рецептов: {created}.'
+        ))
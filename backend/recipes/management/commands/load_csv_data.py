@@ -1,30 +1,157 @@
 import csv
+import json
 import os
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from recipes.ingredient_index import reset_ingredient_index
 from recipes.models import Ingredient
+from recipes.signals import data_loaded
+
+# Сколько символов JSON читается из файла за раз.
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+class JSONArrayReader:
+    """
+    Элементы JSON-массива из файла по одному. Файл читается кусками,
+    в памяти только текущий кусок и недочитанный элемент.
+    """
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file, chunk_size=JSON_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+
+    def next_char(self):
+        """Следующий непробельный символ, '' в конце файла."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position].isspace()
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            self.buffer, self.position = self.file.read(self.chunk_size), 0
+            if not self.buffer:
+                return ''
+
+    def decode(self):
+        """Очередной элемент; недочитанный дополняется из файла."""
+        while True:
+            try:
+                item, self.position = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+                return item
+            except json.JSONDecodeError:
+                chunk = self.file.read(self.chunk_size)
+                if not chunk:
+                    raise
+                self.buffer = self.buffer[self.position:] + chunk
+                self.position = 0
+
+    def __iter__(self):
+        if self.next_char() != '[':
+            raise ValueError('ожидается массив JSON')
+        self.position += 1
+        if self.next_char() == ']':
+            return
+        while True:
+            self.next_char()
+            yield self.decode()
+            char = self.next_char()
+            self.position += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'ожидается "," или "]", а не {char!r}')
 
 
 class Command(BaseCommand):
-    """Добавление ингридиентов из csv-файла в базу данных."""
-    help = 'Загрузка данных из csv-файла.'
+    """
+    Добавление ингридиентов из csv-, json- или ndjson-файла в базу данных.
+    Файл читается потоком, JSON-массив — по элементу. Существующие
+    ингредиенты читаются одним запросом, новые добавляются пачками через
+    bulk_create, поэтому повторный запуск почти ничего не стоит.
+    """
+    help = 'Загрузка ингредиентов из csv-, json- или ndjson-файла.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=os.path.join(settings.BASE_DIR, 'ingredients.csv'),
+            help='Путь к файлу .csv, .json или .ndjson с ингредиентами.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество ингредиентов в одном INSERT.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать новые ингредиенты, ничего не записывая.'
+        )
 
-    def handle(self, *args, **kwargs):
+    def read_rows(self, path):
+        """Пары (название, единица измерения) из файла по одной."""
+        with open(path, 'r', encoding='utf-8') as file:
+            if path.endswith(('.ndjson', '.jsonl')):
+                items = (json.loads(line) for line in file if line.strip())
+            elif path.endswith('.json'):
+                items = JSONArrayReader(file)
+            else:
+                for row in csv.reader(file):
+                    if row:
+                        name, measurement_unit = row
+                        yield name, measurement_unit
+                return
+            for item in items:
+                yield item['name'], item['measurement_unit']
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        existing = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'
+        ))
+        batch = []
+        created = 0
         try:
-            path = os.path.join(settings.BASE_DIR, 'ingredients.csv')
-            with open(
-                path,
-                'r',
-                encoding='utf-8'
-            ) as csv_file:
-                rows = csv.reader(csv_file)
-                for row in rows:
-                    name, measurement_unit = row
-                    Ingredient.objects.get_or_create(
-                        name=name,
-                        measurement_unit=measurement_unit
+            with transaction.atomic():
+                for row in self.read_rows(options['path']):
+                    if row in existing:
+                        continue
+                    existing.add(row)
+                    batch.append(
+                        Ingredient(name=row[0], measurement_unit=row[1])
                     )
+                    if len(batch) >= batch_size:
+                        created += self.save(batch, options['dry_run'])
+                        batch = []
+                created += self.save(batch, options['dry_run'])
+                if created and not options['dry_run']:
+                    data_loaded.send(sender=self.__class__)
         except FileNotFoundError:
-            raise CommandError('Нет файла ingredients.csv в каталоге data')
+            raise CommandError(f'Нет файла {options["path"]}')
+        except (ValueError, KeyError) as error:
+            raise CommandError(f'Неверный формат файла: {error}')
+        if created and not options['dry_run']:
+            reset_ingredient_index()
+        if not options['verbosity']:
+            return
+        action = 'будет добавлено' if options['dry_run'] else 'добавлено'
+        self.stdout.write(
+            f'Ингредиентов {action}: {created}, '
+            f'время: {(time.perf_counter() - started) * 1000:.0f} мс.'
+        )
+
+    def save(self, batch, dry_run):
+        if batch and not dry_run:
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        return len(batch)
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import RecipeRank
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт рейтинга рецептов для ленты ordering=trending.
+    Запускается периодически, например из cron раз в 10–15 минут.
+    """
+    help = 'Пересчёт рейтинга «в тренде» по избранному и спискам покупок.'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = RecipeRank.objects.rebuild()
+        if options['verbosity']:
+            self.stdout.write(
+                f'Рецептов в тренде: {count}, '
+                f'время: {(time.perf_counter() - started) * 1000:.0f} мс.'
+            )
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    """Пересчёт и проверка итогов списков покупок."""
+    help = 'Пересчёт итогов списков покупок по рецептам в корзинах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить сохранённые итоги с пересчитанными.'
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='id пользователя; можно указать несколько раз.'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['users']
+        if not options['verify']:
+            count = ShoppingCartIngredient.objects.rebuild(user_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'Итоги пересчитаны, строк: {count}.'
+            ))
+            return
+        expected = ShoppingCartIngredient.objects.calculate(user_ids)
+        stored = ShoppingCartIngredient.objects.filter(amount__gt=0)
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in stored.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )
+        }
+        mismatches = sorted(
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        )
+        for user_id, ingredient_id in mismatches:
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'сохранено {stored.get((user_id, ingredient_id), 0)}, '
+                f'ожидалось {expected.get((user_id, ingredient_id), 0)}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Расхождений: {len(mismatches)}. '
+                f'Запустите команду без --verify.'
+            )
+        self.stdout.write(self.style.SUCCESS('Итоги совпадают.'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.counters import recount
+
+
+class Command(BaseCommand):
+    """Сверка и пересчёт счётчиков избранного, покупок и подписчиков."""
+    help = 'Пересчёт денормализованных счётчиков рецептов и пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить счётчики с фактическим числом записей.'
+        )
+
+    def handle(self, *args, **options):
+        mismatches = recount(fix=not options['verify'])
+        for (model, field), count in mismatches.items():
+            if count:
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}.{field}: '
+                    f'расхождений {count}'
+                )
+        total = sum(mismatches.values())
+        if options['verify'] and total:
+            raise CommandError(
+                f'Расхождений: {total}. Запустите команду без --verify.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики исправлены, расхождений было: {total}.' if total
+            else 'Счётчики совпадают.'
+        ))
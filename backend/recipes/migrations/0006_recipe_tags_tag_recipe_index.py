@@ -0,0 +1,22 @@
+from django.db import migrations
+
+INDEX_NAME = 'recipes_recipe_tags_tag_recipe_idx'
+
+
+class Migration(migrations.Migration):
+    """
+    Составной индекс (tag_id, recipe_id) промежуточной таблицы тегов.
+    Обратный порядок уже покрыт уникальным ограничением (recipe_id, tag_id).
+    """
+
+    dependencies = [
+        ('recipes', '0005_recipe_pub_date_id_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX {INDEX_NAME} '
+            f'ON recipes_recipe_tags (tag_id, recipe_id)',
+            f'DROP INDEX {INDEX_NAME}',
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:33
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+# (модель, поле счётчика, модель записей, внешний ключ записи).
+COUNTERS = (
+    (('recipes', 'Recipe'), 'favorites_count', ('recipes', 'Favorite'),
+     'recipe'),
+    (('recipes', 'Recipe'), 'shopping_count', ('recipes', 'ShoppingCart'),
+     'recipe'),
+    (('users', 'MyUser'), 'recipes_count', ('recipes', 'Recipe'), 'author'),
+    (('users', 'MyUser'), 'followers_count', ('users', 'Follow'), 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model, field, source, foreign_key in COUNTERS:
+        source = apps.get_model(*source)
+        actual = models.Subquery(
+            source.objects.filter(
+                **{foreign_key: models.OuterRef('pk')}
+            ).order_by().values(foreign_key).annotate(
+                total=models.Count('pk')
+            ).values('total'),
+            output_field=models.IntegerField(),
+        )
+        apps.get_model(*model).objects.update(**{field: Coalesce(actual, 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_tags_tag_recipe_index'),
+        ('users', '0003_myuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='в избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='в списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
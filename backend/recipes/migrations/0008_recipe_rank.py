@@ -0,0 +1,75 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_ranks(apps, schema_editor):
+    """Строки рейтинга для существующих рецептов."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeRank = apps.get_model('recipes', 'RecipeRank')
+    RecipeRank.objects.bulk_create(
+        (
+            RecipeRank(recipe_id=pk)
+            for pk in Recipe.objects.values_list('pk', flat=True)
+        ),
+        batch_size=1000
+    )
+
+
+def backfill_created(apps, schema_editor):
+    """
+    Дата добавления существующих записей неизвестна. Берётся дата
+    публикации рецепта: раньше неё запись появиться не могла, и старое
+    избранное не попадает в рейтинг как новое.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    pub_date = Subquery(
+        Recipe.objects.filter(pk=OuterRef('recipe_id')).values('pub_date')
+    )
+    for name in ('Favorite', 'ShoppingCart'):
+        apps.get_model('recipes', name).objects.update(created=pub_date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRank',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rank', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('trending', models.FloatField(default=0, verbose_name='в тренде')),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now, verbose_name='пересчитано')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинг рецептов',
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='добавлено'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='добавлено'),
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reciperank',
+            index=models.Index(fields=['-trending', '-recipe'], name='recipe_rank_trending_idx'),
+        ),
+        migrations.RunPython(create_ranks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='ширины миниатюр'),
+        ),
+    ]
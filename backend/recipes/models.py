@@ -1,7 +1,12 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import TruncHour
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -138,13 +143,50 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         'дата публикации',
         auto_now_add=True,
-        db_index=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        'в избранном',
+        default=0,
+        editable=False
+    )
+    shopping_count = models.PositiveIntegerField(
+        'в списках покупок',
+        default=0,
+        editable=False
+    )
+    thumbnails = models.JSONField(
+        'ширины миниатюр',
+        default=list,
+        blank=True,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        'поисковый вектор',
+        null=True,
+        editable=False
     )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            # Ключ постраничной выдачи ленты (api.paginations).
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            # Порядок ordering=popular.
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_favorites_count_id_idx'
+            ),
+            # Последние рецепты автора в подписках.
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name[:settings.RECIPE_SHOTNAME]
@@ -209,6 +251,11 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        'добавлено',
+        default=timezone.now,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -238,6 +285,11 @@ class ShoppingCart(models.Model):
         related_name='shopcarts',
         verbose_name='Рецепты'
     )
+    created = models.DateTimeField(
+        'добавлено',
+        default=timezone.now,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -251,3 +303,257 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'У {self.user} в списке покупок {self.recipe}'
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    """Поддержка итогов списка покупок в актуальном состоянии."""
+
+    def apply(self, user_ids, deltas):
+        """
+        Прибавляет к итогам пользователей изменения количества
+        ингредиентов deltas = {id ингредиента: изменение}.
+        Строки с нулевым количеством не удаляются, чтобы время изменения
+        списка покупок оставалось монотонным.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not user_ids or not deltas:
+            return
+        updated = timezone.now()
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids
+            ).order_by('pk').values_list('pk', flat=True))
+            existing = {
+                (row.user_id, row.ingredient_id): row
+                for row in self.filter(
+                    user_id__in=user_ids, ingredient_id__in=deltas
+                )
+            }
+            created = []
+            for user_id in user_ids:
+                for ingredient_id, delta in deltas.items():
+                    row = existing.get((user_id, ingredient_id))
+                    if row is not None:
+                        row.amount = max(row.amount + delta, 0)
+                        row.updated = updated
+                    elif delta > 0:
+                        created.append(self.model(
+                            user_id=user_id,
+                            ingredient_id=ingredient_id,
+                            amount=delta,
+                            updated=updated,
+                        ))
+            if existing:
+                self.bulk_update(existing.values(), ('amount', 'updated'))
+            if created:
+                self.bulk_create(created)
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        """Учитывает в итогах добавление (удаление) рецепта из списка."""
+        self.add_recipes(user_id, [recipe_id], sign)
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        """То же для нескольких рецептов, состав читается одним запросом."""
+        if not recipe_ids:
+            return
+        amounts = Amount.objects.filter(recipe_id__in=recipe_ids).values(
+            'ingredient_id'
+        ).annotate(total=models.Sum('amount')).order_by().values_list(
+            'ingredient_id', 'total'
+        )
+        self.apply(
+            [user_id],
+            {ingredient_id: sign * total for ingredient_id, total in amounts}
+        )
+
+    def change_recipe(self, recipe, old_amounts, new_amounts=None):
+        """
+        Учитывает изменение ингредиентов рецепта у всех пользователей,
+        у которых он в списке покупок.
+        old_amounts и new_amounts = {id ингредиента: количество} до и
+        после изменения; без new_amounts они читаются из базы.
+        """
+        if new_amounts is None:
+            new_amounts = dict(recipe.amounts.values_list(
+                'ingredient_id', 'amount'
+            ))
+        deltas = {pk: -amount for pk, amount in old_amounts.items()}
+        for ingredient_id, amount in new_amounts.items():
+            deltas[ingredient_id] = deltas.get(ingredient_id, 0) + amount
+        self.apply(
+            list(recipe.shopcarts.values_list('user_id', flat=True)), deltas
+        )
+
+    def calculate(self, user_ids=None):
+        """Итоги, посчитанные заново по спискам покупок."""
+        queryset = Amount.objects.filter(recipe__shopcarts__isnull=False)
+        if user_ids is not None:
+            queryset = queryset.filter(recipe__shopcarts__user__in=user_ids)
+        return {
+            (row['user_id'], row['ingredient_id']): row['total']
+            for row in queryset.values(
+                'ingredient_id', user_id=models.F('recipe__shopcarts__user')
+            ).annotate(total=models.Sum('amount')).order_by()
+        }
+
+    def rebuild_recipes(self, recipe_ids):
+        """
+        Пересчитывает итоги пользователей, у которых рецепты в списке
+        покупок. Для правок состава в админке, где изменения не
+        проходят через change_recipe.
+        """
+        user_ids = list(ShoppingCart.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('user_id', flat=True).distinct())
+        if user_ids:
+            self.rebuild(user_ids)
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает итоги пользователей с нуля."""
+        updated = timezone.now()
+        with transaction.atomic():
+            totals = self.calculate(user_ids)
+            queryset = self.all()
+            if user_ids is not None:
+                queryset = queryset.filter(user_id__in=user_ids)
+            queryset.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                        updated=updated,
+                    )
+                    for (user_id, ingredient_id), amount in totals.items()
+                ),
+                batch_size=1000
+            )
+        return len(totals)
+
+
+class ShoppingCartIngredient(models.Model):
+    """
+    Итоговое количество ингредиента в списке покупок пользователя.
+    Обновляется при изменении списка покупок и состава рецептов,
+    чтобы выгрузка списка была одним чтением по индексу.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('количество', default=0)
+    updated = models.DateTimeField('изменено', default=timezone.now)
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return (f'У {self.user} в списке покупок {self.ingredient.name} '
+                f'{self.amount} {self.ingredient.measurement_unit}')
+
+
+class RecipeRankManager(models.Manager):
+    """Пересчёт рейтинга рецептов."""
+
+    def calculate(self, now=None):
+        """
+        Рейтинг «в тренде» по добавлениям в избранное и список покупок
+        за последние TRENDING_WINDOW_DAYS дней: каждое добавление весит
+        тем меньше, чем оно старше, вес убывает вдвое каждые
+        TRENDING_HALF_LIFE_HOURS часов.
+        Возвращает {id рецепта: рейтинг}.
+        """
+        now = now or timezone.now()
+        since = now - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+        half_life = settings.TRENDING_HALF_LIFE_HOURS * 3600
+        scores = {}
+        for model in (Favorite, ShoppingCart):
+            # Добавления группируются по часам, чтобы не читать каждое.
+            rows = model.objects.filter(created__gte=since).values(
+                'recipe_id', hour=TruncHour('created')
+            ).annotate(events=models.Count('id')).order_by()
+            for row in rows:
+                age = max((now - row['hour']).total_seconds(), 0)
+                scores[row['recipe_id']] = (
+                    scores.get(row['recipe_id'], 0)
+                    + row['events'] * 0.5 ** (age / half_life)
+                )
+        return scores
+
+    def rebuild(self, now=None):
+        """
+        Записывает рейтинг всех рецептов.
+        Возвращает число рецептов с ненулевым рейтингом.
+        """
+        now = now or timezone.now()
+        scores = self.calculate(now)
+        with transaction.atomic():
+            self.bulk_create(
+                (
+                    self.model(recipe_id=pk, updated=now)
+                    for pk in Recipe.objects.filter(
+                        rank__isnull=True
+                    ).values_list('pk', flat=True)
+                ),
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+            self.exclude(recipe_id__in=scores).exclude(trending=0).update(
+                trending=0, updated=now
+            )
+            ranks = list(self.filter(recipe_id__in=scores))
+            for rank in ranks:
+                rank.trending = scores[rank.recipe_id]
+                rank.updated = now
+            self.bulk_update(ranks, ('trending', 'updated'), batch_size=1000)
+        return len(scores)
+
+
+class RecipeRank(models.Model):
+    """
+    Рейтинг рецепта для ленты ordering=trending.
+    Считается периодически командой rank_recipes, поэтому лента
+    читается по индексу без агрегации избранного в запросе.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='rank',
+        verbose_name='Рецепт'
+    )
+    trending = models.FloatField('в тренде', default=0)
+    updated = models.DateTimeField('пересчитано', default=timezone.now)
+
+    objects = RecipeRankManager()
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинг рецептов'
+        indexes = [
+            models.Index(
+                fields=('-trending', '-recipe'),
+                name='recipe_rank_trending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}: {self.trending:.2f}'
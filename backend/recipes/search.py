@@ -0,0 +1,152 @@
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+WORD = re.compile(r'\w+')
+# Символ больше любой буквы: граница диапазона слов с заданным префиксом.
+PREFIX_END = '\U0010ffff'
+# Вес слова из названия и из описания, как A и B в tsvector.
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+
+
+def use_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def get_search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(queryset=None):
+    """Пересчитывает Recipe.search_vector; вне PostgreSQL ничего не делает."""
+    if not use_postgres():
+        return
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    queryset.update(search_vector=get_search_vector())
+
+
+class RecipeSearchIndex:
+    """
+    Обратный индекс рецептов в памяти процесса для баз без полнотекстового
+    поиска (SQLite при разработке).
+    Слово запроса совпадает со словами, которые с него начинаются, что
+    грубо заменяет стемминг; рецепт должен содержать все слова запроса.
+    """
+
+    def __init__(self, recipes):
+        postings = defaultdict(lambda: defaultdict(float))
+        for pk, name, text in recipes:
+            for word in WORD.findall(name.lower()):
+                postings[word][pk] += NAME_WEIGHT
+            for word in WORD.findall(text.lower()):
+                postings[word][pk] += TEXT_WEIGHT
+        self.words = tuple(sorted(postings))
+        self.postings = tuple(dict(postings[word]) for word in self.words)
+        self.built = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        return cls(Recipe.objects.values_list('id', 'name', 'text'))
+
+    def search(self, query):
+        """{id рецепта: релевантность} для рецептов со всеми словами."""
+        scores = None
+        for term in WORD.findall(query.lower()):
+            start = bisect_left(self.words, term)
+            end = bisect_left(self.words, term + PREFIX_END, start)
+            found = defaultdict(float)
+            for position in range(start, end):
+                for pk, weight in self.postings[position].items():
+                    found[pk] += weight
+            if scores is None:
+                scores = found
+            else:
+                scores = {
+                    pk: score + found[pk]
+                    for pk, score in scores.items() if pk in found
+                }
+            if not scores:
+                return {}
+        return dict(scores or {})
+
+
+_state = {'index': None}
+_lock = threading.Lock()
+
+
+def get_search_index():
+    """Индекс текущего процесса, перестраивается как индекс ингредиентов."""
+    index = _state['index']
+    if (
+        index is None
+        or time.monotonic() - index.built > settings.RECIPE_SEARCH_INDEX_TTL
+    ):
+        with _lock:
+            if _state['index'] is index:
+                _state['index'] = RecipeSearchIndex.build()
+        return _state['index']
+    return index
+
+
+def reset_search_index():
+    _state['index'] = None
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты выборки, подходящие под запрос, с аннотацией search_rank.
+    В PostgreSQL — по search_vector с GIN-индексом, иначе — по индексу
+    в памяти процесса, не больше RECIPE_SEARCH_MAX_RESULTS лучших.
+    """
+    if use_postgres():
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        # ts_rank возвращает real: в курсоре KeysetPagination значение
+        # становится double, и сравнение с ним повторяло бы граничную
+        # строку. Приведение к double сравнивает ранг без потерь.
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=Cast(
+                SearchRank(F('search_vector'), search_query), FloatField()
+            )
+        )
+    # id и ранги совпадений входят в каждый запрос выборки (страница,
+    # COUNT), поэтому берутся только лучшие совпадения в порядке
+    # выдачи по релевантности, а ранги — одной ветвью CASE на значение.
+    top = heapq.nsmallest(
+        settings.RECIPE_SEARCH_MAX_RESULTS,
+        get_search_index().search(query).items(),
+        key=lambda item: (-item[1], -item[0]),
+    )
+    ranks = defaultdict(list)
+    for pk, score in top:
+        ranks[score].append(pk)
+    return queryset.filter(pk__in=[pk for pk, score in top]).annotate(
+        search_rank=Case(
+            *(When(pk__in=pks, then=Value(score))
+              for score, pks in ranks.items()),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import Signal, receiver
+
+from .counters import COUNTERS, change_counter
+from .ingredient_index import reset_ingredient_index
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeRank,
+    ShoppingCart,
+    ShoppingCartIngredient,
+)
+from .search import (
+    reset_search_index,
+    update_search_vectors,
+    use_postgres,
+)
+from .thumbnails import schedule_thumbnails
+
+# Данные загружены пачками (bulk_create/bulk_update) в обход сигналов
+# моделей. user_ids — пользователи, у которых изменились избранное,
+# список покупок или подписки.
+data_loaded = Signal()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def reset_ingredient_search(sender, **kwargs):
+    """Перестраивает индекс автодополнения после изменения ингредиентов."""
+    transaction.on_commit(reset_ingredient_index)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_rank(sender, instance, created, **kwargs):
+    """Новый рецепт сразу попадает в ленту ordering=trending."""
+    if created:
+        RecipeRank.objects.create(recipe=instance)
+
+
+@receiver(pre_save, sender=Recipe)
+def check_recipe_image(sender, instance, **kwargs):
+    """Новая, ещё не сохранённая картинка сбрасывает миниатюры."""
+    instance._new_image = bool(instance.image) and not (
+        instance.image._committed
+    )
+    if instance._new_image:
+        instance.thumbnails = []
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_thumbnails(sender, instance, **kwargs):
+    """Миниатюры создаются в фоне, не задерживая ответ."""
+    if getattr(instance, '_new_image', False):
+        schedule_thumbnails(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(sender, instance, update_fields, **kwargs):
+    """Обновляет поисковый вектор рецепта при изменении текста."""
+    if update_fields is not None and not {'name', 'text'} & update_fields:
+        return
+    if use_postgres():
+        update_search_vectors(Recipe.objects.filter(pk=instance.pk))
+    else:
+        transaction.on_commit(reset_search_index)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_search(sender, **kwargs):
+    if not use_postgres():
+        transaction.on_commit(reset_search_index)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта в итоги списка покупок."""
+    if created:
+        ShoppingCartIngredient.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_cart_totals(sender, instance, **kwargs):
+    """
+    Вычитает ингредиенты рецепта из итогов списка покупок.
+    pre_delete срабатывает до каскадного удаления Amount,
+    поэтому состав рецепта ещё доступен.
+    """
+    ShoppingCartIngredient.objects.add_recipe(
+        instance.user_id, instance.recipe_id, sign=-1
+    )
+
+
+def counter_handlers(model, field, foreign_key):
+    """Обработчики создания и удаления записи для одного счётчика."""
+    attname = f'{foreign_key}_id'
+
+    def increment(sender, instance, created, **kwargs):
+        if created:
+            change_counter(model, getattr(instance, attname), field, 1)
+
+    def decrement(sender, instance, **kwargs):
+        change_counter(model, getattr(instance, attname), field, -1)
+
+    return increment, decrement
+
+
+for model, field, source, foreign_key in COUNTERS:
+    increment, decrement = counter_handlers(model, field, foreign_key)
+    post_save.connect(
+        increment, sender=source, weak=False,
+        dispatch_uid=f'increment_{model._meta.model_name}_{field}'
+    )
+    post_delete.connect(
+        decrement, sender=source, weak=False,
+        dispatch_uid=f'decrement_{model._meta.model_name}_{field}'
+    )
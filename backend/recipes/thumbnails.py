@@ -0,0 +1,114 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Расширение файла: (формат Pillow, параметры сохранения).
+FORMATS = {
+    'webp': ('WEBP', {'quality': 75, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.THUMBNAIL_WORKERS,
+    thread_name_prefix='thumbnails',
+)
+
+
+def get_thumbnail_name(name, width, extension):
+    return f'thumbnails/{os.path.splitext(name)[0]}_{width}.{extension}'
+
+
+def get_thumbnail_url(name, width, extension):
+    return default_storage.url(get_thumbnail_name(name, width, extension))
+
+
+def get_srcset(recipe):
+    """
+    Миниатюры рецепта в формате атрибута srcset для каждого формата:
+    {'webp': 'url 240w, url 480w', 'jpeg': ...}.
+    Пока миниатюры не готовы, возвращает None.
+    """
+    if not recipe.thumbnails:
+        return None
+    name = recipe.image.name
+    return {
+        extension: ', '.join(
+            f'{get_thumbnail_url(name, width, extension)} {width}w'
+            for width in recipe.thumbnails
+        )
+        for extension in FORMATS
+    }
+
+
+def generate_thumbnails(recipe_id, name):
+    """
+    Создаёт миниатюры ширины THUMBNAIL_WIDTHS во всех форматах и
+    записывает ширины в Recipe.thumbnails. Изображение не увеличивается:
+    последняя миниатюра не шире оригинала.
+    Если картинку рецепта успели заменить, результат не записывается.
+    """
+    try:
+        with default_storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+    except (OSError, UnidentifiedImageError) as error:
+        logger.warning('Нет миниатюр для %s: %s', name, error)
+        return []
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    widths = []
+    for width in sorted(settings.THUMBNAIL_WIDTHS):
+        thumbnail = image.copy()
+        thumbnail.thumbnail((width, image.height))
+        for extension, (image_format, options) in FORMATS.items():
+            buffer = BytesIO()
+            thumbnail.save(buffer, image_format, **options)
+            thumbnail_name = get_thumbnail_name(
+                name, thumbnail.width, extension
+            )
+            default_storage.delete(thumbnail_name)
+            default_storage.save(
+                thumbnail_name, ContentFile(buffer.getvalue())
+            )
+        widths.append(thumbnail.width)
+        if width >= image.width:
+            break
+    recipe = Recipe.objects.filter(pk=recipe_id, image=name).first()
+    if recipe is not None:
+        recipe.thumbnails = widths
+        recipe.save(update_fields=('thumbnails',))
+    return widths
+
+
+def run_in_worker(recipe_id, name):
+    try:
+        generate_thumbnails(recipe_id, name)
+    except Exception:
+        logger.exception('Ошибка создания миниатюр для %s', name)
+    finally:
+        # У потока пула своё соединение с БД, его нужно закрыть.
+        connection.close()
+
+
+def schedule_thumbnails(recipe):
+    """
+    Создание миниатюр после фиксации транзакции: в пуле потоков
+    (THUMBNAIL_ASYNC) или сразу, если фоновая обработка выключена.
+    """
+    recipe_id, name = recipe.pk, recipe.image.name
+    if settings.THUMBNAIL_ASYNC:
+        transaction.on_commit(
+            lambda: _executor.submit(run_in_worker, recipe_id, name)
+        )
+    else:
+        transaction.on_commit(lambda: generate_thumbnails(recipe_id, name))
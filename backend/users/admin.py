@@ -7,7 +7,12 @@ from .models import Follow, MyUser
 
 class MyUserAdmin(UserAdmin):
     """Кастомное отображение модели User а админке."""
-    list_display = ('username', 'first_name', 'last_name', 'email')
+    list_display = ('username', 'first_name', 'last_name', 'email',
+                    'recipes_count', 'followers_count')
+    readonly_fields = ('recipes_count', 'followers_count')
+    fieldsets = UserAdmin.fieldsets + (
+        ('Счётчики', {'fields': ('recipes_count', 'followers_count')}),
+    )
     list_filter = ('email', 'first_name')
     search_fields = ('username', 'email')
     empty_value_display = '-нет-'
@@ -6,6 +6,7 @@ from django.db.models import (
     EmailField,
     ForeignKey,
     Model,
+    PositiveIntegerField,
     UniqueConstraint,
 )
 from rest_framework.exceptions import ValidationError
@@ -33,6 +34,16 @@ class MyUser(AbstractUser):
         'Подписан',
         default=False
     )
+    recipes_count = PositiveIntegerField(
+        'Рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = PositiveIntegerField(
+        'Подписчиков',
+        default=0,
+        editable=False
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')